@@ -6,34 +6,85 @@ Uses PyInstaller to package the application
 import subprocess
 import sys
 import os
+import hashlib
 import platform
 import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
-def run_command(command, shell=True):
-    """Run a command and print output"""
+# PyInstaller intermediates go to tmpfs (Linux) only when it has room for a
+# torch-sized workpath (small tmpfs mounts, e.g. Docker's 64 MB, would hit ENOSPC)
+SHM_MIN_FREE_GB = float(os.environ.get('BUILD_SHM_MIN_FREE_GB', '8'))
+
+def _pick_work_path() -> Path:
+    shm = Path('/dev/shm')
     try:
-        result = subprocess.run(command, shell=shell, check=True, 
-                              capture_output=True, text=True)
-        print(result.stdout)
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e.stderr}")
+        if shm.is_dir() and shutil.disk_usage(shm).free >= SHM_MIN_FREE_GB * 1024 ** 3:
+            return shm / 'text-to-3d-build'
+    except OSError:
+        pass
+    return Path('build')
+
+WORK_PATH = _pick_work_path()
+
+# Persistent PyInstaller work directories, keyed by dependency/entry-point hash
+ANALYSIS_CACHE_DIR = Path.home() / '.cache' / 'text-to-3d'
+
+# PyInstaller config/bincache dir per checkout, so it survives between builds
+CHECKOUT_KEY = hashlib.sha256(str(Path.cwd().resolve()).encode()).hexdigest()[:12]
+PYINSTALLER_CONFIG_DIR = ANALYSIS_CACHE_DIR / f'pyinstaller-{CHECKOUT_KEY}'
+ANALYSIS_KEY_FILE = WORK_PATH / '.analysis-key'
+
+def run_command(command, shell=True, env=None):
+    """Run a command, streaming its output line by line"""
+    env = {**(env or os.environ), 'PYTHONUNBUFFERED': '1'}
+    try:
+        process = subprocess.Popen(command, shell=shell, env=env, text=True, bufsize=1,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        for line in process.stdout:
+            sys.stdout.write(line)
+        returncode = process.wait()
+    except OSError as e:
+        print(f"Error: {e}")
         return False
+    
+    if returncode != 0:
+        print(f"Error: command exited with code {returncode}")
+        return False
+    return True
 
 def install_build_deps():
     """Install build dependencies"""
     print("Installing build dependencies...")
-    deps = ["pyinstaller", "auto-py-to-exe"]
+    deps = ["pyinstaller>=6.0", "auto-py-to-exe", "lazy_loader"]
     
-    for dep in deps:
-        if not run_command(f"pip install {dep}"):
-            print(f"Failed to install {dep}")
-            return False
+    # One resolver run for the whole set, against the interpreter running this script
+    packages = " ".join(f'"{dep}"' for dep in deps)
+    if not run_command(f'"{sys.executable}" -m pip install --disable-pip-version-check '
+                       f'--no-input --prefer-binary {packages}'):
+        print(f"Failed to install {', '.join(deps)}")
+        return False
     return True
 
+def create_runtime_hooks():
+    """Create runtime hook that defers heavy imports until first attribute access"""
+    hook_content = '''# Installed by build_executable.py - runs before main.py in the frozen app
+import lazy_loader as lazy
+
+for _name in ('torch', 'transformers', 'cadquery', 'faiss', 'sentence_transformers'):
+    lazy.load(_name)
+'''
+    
+    Path('runtime_hooks').mkdir(exist_ok=True)
+    with open('runtime_hooks/lazy_hook.py', 'w') as f:
+        f.write(hook_content)
+    
+    print("Created lazy-import runtime hook: runtime_hooks/lazy_hook.py")
+
 def create_spec_file():
     """Create PyInstaller spec file"""
+    create_runtime_hooks()
+    
     spec_content = '''# -*- mode: python ; coding: utf-8 -*-
 import sys
 from pathlib import Path
@@ -47,61 +98,80 @@ a = Analysis(
     ['main.py'],
     pathex=[str(project_root)],
     binaries=[],
+    # src/ is collected as optimized bytecode through the import graph,
+    # so its sources are not shipped as data; embeddings/ ships next to the
+    # executable instead of inside the bundle (see build_executable)
     datas=[
-        ('src', 'src'),
-        ('embeddings', 'embeddings'),
         ('.env.example', '.'),
         ('README.md', '.'),
     ],
+    # Only third-party packages the app imports itself; stdlib modules and
+    # torch/transformers (pulled in by sentence_transformers) are found by analysis
     hiddenimports=[
         'cadquery',
+        'cadquery.vis',
         'sentence_transformers',
         'faiss',
         'customtkinter',
-        'ollama',
-        'transformers',
-        'torch',
+        'dotenv',
         'numpy',
-        'PIL',
-        'tkinter',
-        'json',
-        're',
-        'os',
-        'sys',
-        'pathlib',
-        'typing',
-        'threading',
-        'queue',
-        'time',
-        'datetime',
-        'logging',
-        'subprocess',
-        'shutil',
-        'tempfile',
         'requests',
     ],
     hookspath=[],
     hooksconfig={},
-    runtime_hooks=[],
-    excludes=[],
+    # App modules ship as bytecode only, never alongside their .py sources
+    module_collection_mode={
+        'src': 'pyc',
+        'desktop_app': 'pyc',
+    },
+    runtime_hooks=['runtime_hooks/lazy_hook.py'],
+    # Optional backends and dev tooling that optional imports drag in
+    excludes=[
+        'tensorflow',
+        'keras',
+        'flax',
+        'jax',
+        'matplotlib',
+        'pytest',
+        'IPython',
+        'notebook',
+        'jupyter_client',
+        'torch.utils.tensorboard',
+    ],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
-    noarchive=False,
+    noarchive=True,  # Loose .pyc files are read on demand instead of unpacking a PYZ
+    optimize=2,  # Strip docstrings and asserts from bundled bytecode
 )
 
 pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
 
+# Splash screen shown by the bootloader while heavy imports load (not supported on macOS)
+splash = None
+if Path('splash.png').exists() and sys.platform != 'darwin':
+    splash = Splash(
+        'splash.png',
+        binaries=a.binaries,
+        datas=a.datas,
+        text_pos=(10, 50),
+        text_size=12,
+        text_color='white',
+        always_on_top=True,
+    )
+
 exe = EXE(
     pyz,
+    *([splash] if splash else []),
     a.scripts,
     [],
     exclude_binaries=True,
     name='Text-to-3D',
     debug=False,
     bootloader_ignore_signals=False,
-    strip=False,
+    strip=sys.platform != 'win32',
     upx=True,
+    upx_exclude=['vcruntime140*.dll', 'VCRUNTIME*.dll', 'python3*.dll', 'api-ms-win-*.dll'],
     console=False,  # Set to True for debugging
     disable_windowed_traceback=False,
     target_arch=None,
@@ -113,11 +183,24 @@ exe = EXE(
 coll = COLLECT(
     exe,
     a.binaries,
+    *([splash.binaries] if splash else []),
     a.zipfiles,
     a.datas,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
+    strip=sys.platform == 'darwin',  # Linux libraries are stripped in parallel after the build
+    # PyInstaller's UPX pass skips Control Flow Guard DLLs/PYDs and Qt plugins, which
+    # UPX breaks; not used on Linux, where packed libraries can't be stripped afterwards
+    upx=sys.platform == 'win32',
+    # Libraries known to break (or gain nothing) when UPX-packed
+    upx_exclude=[
+        'vcruntime140*.dll',
+        'VCRUNTIME*.dll',
+        'python3*.dll',
+        'api-ms-win-*.dll',
+        'torch_cpu.dll',
+        'torch_cuda*.dll',
+        'qwindows.dll',
+        'libcrypto-*.dll',
+    ],
     name='Text-to-3D',
 )
 
@@ -140,12 +223,89 @@ if sys.platform == 'darwin':
             ]
         },
     )
+
+# Module graph for deploy.py, written only once the bundle is complete
+import pickle
+Path('build').mkdir(exist_ok=True)
+with open(Path('build') / 'modgraph.pkl', 'wb') as f:
+    pickle.dump({
+        'bundle': app.name if sys.platform == 'darwin' else coll.name,
+        'pure': list(a.pure),
+        'binaries': list(a.binaries),
+        'datas': list(a.datas),
+    }, f)
 '''
     
     with open('text-to-3d.spec', 'w') as f:
         f.write(spec_content)
     
-    print("Created PyInstaller spec file: text-to-3d.spec")
+    # Console build for debugging: same Analysis inputs, unpacked and verbose
+    debug_content = (spec_content
+                     .replace("name='Text-to-3D',", "name='Text-to-3D-debug',")
+                     .replace("name='Text-to-3D.app',", "name='Text-to-3D-debug.app',")
+                     .replace("debug=False,", "debug=True,")
+                     .replace("console=False,  # Set to True for debugging", "console=True,")
+                     .replace("upx=True,", "upx=False,")
+                     .replace("upx=sys.platform == 'win32',", "upx=False,")
+                     .replace("strip=sys.platform != 'win32',", "strip=False,")
+                     .replace("strip=sys.platform == 'darwin',", "strip=False,")
+                     .replace("'modgraph.pkl'", "'modgraph-debug.pkl'"))
+    with open('text-to-3d-debug.spec', 'w') as f:
+        f.write(debug_content)
+    
+    print("Created PyInstaller spec files: text-to-3d.spec, text-to-3d-debug.spec")
+
+def _strip_binary(path):
+    """Strip debug symbols from a single shared library (runs in a worker process)"""
+    result = subprocess.run(['strip', '--strip-unneeded', str(path)], capture_output=True, text=True)
+    return path, result.returncode
+
+def strip_binaries(dist_dir):
+    """Strip debug info from bundled ELF libraries in parallel (Linux only)"""
+    # Windows DLLs keep debug info in separate PDBs; macOS is stripped by PyInstaller before signing
+    if platform.system() != "Linux" or not shutil.which('strip'):
+        return
+    
+    binaries = [p for p in dist_dir.rglob('*')
+                if p.is_file() and not p.is_symlink() and (p.suffix == '.so' or '.so.' in p.name)]
+    print(f"Stripping {len(binaries)} shared libraries on {os.cpu_count()} cores...")
+    
+    with ProcessPoolExecutor() as pool:
+        for path, returncode in pool.map(_strip_binary, binaries):
+            if returncode != 0:
+                print(f"  Could not strip {path.name} (strip exit code {returncode})")
+
+def analysis_cache_key():
+    """Hash the inputs that decide PyInstaller's Analysis result"""
+    digest = hashlib.blake2b(sys.version.encode())
+    for name in ('requirements.txt', 'main.py', 'text-to-3d.spec'):
+        if Path(name).exists():
+            digest.update(Path(name).read_bytes())
+    return digest.hexdigest()
+
+def restore_analysis_cache(key):
+    """Reuse a cached work directory for this key; returns True when Analysis can be skipped"""
+    if ANALYSIS_KEY_FILE.exists() and ANALYSIS_KEY_FILE.read_text().strip() == key:
+        print(f"Reusing Analysis from {WORK_PATH} (dependencies unchanged)")
+        return True
+    
+    cached = ANALYSIS_CACHE_DIR / f'build-{key}'
+    if cached.exists():
+        print(f"Restoring cached Analysis from {cached}")
+        shutil.rmtree(WORK_PATH, ignore_errors=True)
+        shutil.copytree(cached, WORK_PATH)
+        return True
+    return False
+
+def save_analysis_cache(key):
+    """Store the work directory so later builds with the same key skip Analysis"""
+    ANALYSIS_KEY_FILE.write_text(key)
+    cached = ANALYSIS_CACHE_DIR / f'build-{key}'
+    try:
+        shutil.rmtree(cached, ignore_errors=True)
+        shutil.copytree(WORK_PATH, cached)
+    except OSError as e:
+        print(f"Could not cache Analysis: {e}")
 
 def build_executable():
     """Build the executable using PyInstaller"""
@@ -153,16 +313,41 @@ def build_executable():
     
     print(f"Building executable for {system}...")
     
-    # Build using the spec file
-    build_cmd = "pyinstaller text-to-3d.spec --clean --noconfirm"
+    # Per-checkout config/cache dir: builds of other checkouts don't touch its
+    # bincache, and it is reused (not recreated empty) on the next build
+    os.environ.setdefault('PYINSTALLER_CONFIG_DIR', str(PYINSTALLER_CONFIG_DIR))
+    
+    # Build using the spec file; --clean only when the dependency tree changed
+    key = analysis_cache_key()
+    build_flags = ['--workpath', str(WORK_PATH), '--distpath', 'dist', '--noconfirm']
+    if not restore_analysis_cache(key):
+        build_flags.append('--clean')
+    if os.environ.get('UPX_DIR'):
+        build_flags += ['--upx-dir', os.environ['UPX_DIR']]
+    
+    # Run PyInstaller from this interpreter rather than whatever 'pyinstaller' is on PATH
+    pyinstaller = [sys.executable, '-m', 'PyInstaller']
+    builds = [(pyinstaller + build_flags + ['text-to-3d.spec'], None)]
+    if os.environ.get('BUILD_DEBUG', 'false').lower() == 'true':
+        # Separate config dir: --clean wipes the bincache of the build using it
+        debug_env = dict(os.environ, PYINSTALLER_CONFIG_DIR=os.environ['PYINSTALLER_CONFIG_DIR'] + '-debug')
+        builds.append((pyinstaller + build_flags + ['text-to-3d-debug.spec'], debug_env))
+        print("Building release and debug variants concurrently...")
     
-    if not run_command(build_cmd):
+    with ThreadPoolExecutor(max_workers=len(builds)) as pool:
+        results = list(pool.map(lambda build: run_command(build[0], shell=False, env=build[1]), builds))
+    
+    if not all(results):
         print("Build failed!")
         return False
     
+    save_analysis_cache(key)
+    
     # Copy additional files
     dist_dir = Path('dist/Text-to-3D')
     if dist_dir.exists():
+        strip_binaries(dist_dir)
+        
         # Copy environment file
         if Path('.env.example').exists():
             shutil.copy2('.env.example', dist_dir)
@@ -171,6 +356,10 @@ def build_executable():
         if Path('reference_examples').exists():
             shutil.copytree('reference_examples', dist_dir / 'reference_examples', dirs_exist_ok=True)
         
+        # Embedding/FAISS cache side-pack, read in place by the frozen app
+        if Path('embeddings').exists():
+            shutil.copytree('embeddings', dist_dir / 'embeddings', dirs_exist_ok=True)
+        
         print(f"Build completed! Executable available in: {dist_dir}")
         
         if system == "windows":
@@ -3,13 +3,51 @@
 Deployment script for Text-to-3D
 Creates distributable packages with all necessary components
 """
+import json
+import pickle
 import shutil
 import zipfile
 import platform
 import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
 import os
 
+# Already-compressed payloads (archives, images) gain nothing from deflate
+STORED_EXTENSIONS = {'.zip', '.whl', '.pyz', '.png', '.jpg', '.bin', '.onnx'}
+# Native libraries: stored only when UPX-packed (PyInstaller packs some, on Windows only)
+NATIVE_EXTENSIONS = {'.dll', '.pyd', '.so', '.dylib'}
+
+# Files up to this size are read ahead by worker threads while earlier entries compress
+ZIP_PREFETCH_LIMIT = 8 * 1024 * 1024
+
+# Model the launchers expect; set BUNDLE_OLLAMA_MODEL=true to ship its weights in the package
+OLLAMA_MODEL = "llama3.1:8b"
+
+def _link_or_copy(src, dst):
+    """Hard-link a file, copying when src and dst are on different filesystems"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def _link_tree(src, dst):
+    """Stage a build tree with hard links instead of copying every byte"""
+    shutil.copytree(src, dst, symlinks=True, copy_function=_link_or_copy)
+
+def load_module_graph(path=Path("build") / "modgraph.pkl"):
+    """Load the module graph the PyInstaller spec writes after a complete build"""
+    if not path.exists():
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        print(f"Warning: could not read module graph {path}: {e}")
+        return None
+
 def create_distribution_package():
     """Create a complete distribution package"""
     system = platform.system().lower()
@@ -31,21 +69,27 @@ def create_distribution_package():
         print("Error: No dist directory found. Run build_executable.py first.")
         return False
     
-    if system == "windows":
+    graph = load_module_graph()
+    if graph and Path(graph['bundle']).exists():
+        bundle = Path(graph['bundle'])
+        print(f"Using build module graph: {len(graph['pure'])} modules, "
+              f"{len(graph['binaries'])} binaries, {len(graph['datas'])} data files")
+        _link_tree(bundle, package_dir / bundle.name)
+    elif system == "windows":
         if (dist_dir / "Text-to-3D" / "Text-to-3D.exe").exists():
-            shutil.copytree(dist_dir / "Text-to-3D", package_dir / "Text-to-3D")
+            _link_tree(dist_dir / "Text-to-3D", package_dir / "Text-to-3D")
         else:
             print("Error: Windows executable not found")
             return False
     elif system == "darwin":
         if (dist_dir / "Text-to-3D.app").exists():
-            shutil.copytree(dist_dir / "Text-to-3D.app", package_dir / "Text-to-3D.app")
+            _link_tree(dist_dir / "Text-to-3D.app", package_dir / "Text-to-3D.app")
         else:
             print("Error: macOS app bundle not found")
             return False
     else:  # Linux
         if (dist_dir / "Text-to-3D" / "Text-to-3D").exists():
-            shutil.copytree(dist_dir / "Text-to-3D", package_dir / "Text-to-3D")
+            _link_tree(dist_dir / "Text-to-3D", package_dir / "Text-to-3D")
         else:
             print("Error: Linux executable not found")
             return False
@@ -74,7 +118,11 @@ def create_distribution_package():
     
     # Copy reference examples if they exist
     if Path("reference_examples").exists():
-        shutil.copytree("reference_examples", package_dir / "reference_examples")
+        _link_tree("reference_examples", package_dir / "reference_examples")
+    
+    # Ship the Ollama model so first launch doesn't download it
+    if os.environ.get('BUNDLE_OLLAMA_MODEL', 'false').lower() == 'true':
+        bundle_ollama_model(package_dir)
     
     # Create a simple launcher script
     create_launcher_scripts(package_dir, system)
@@ -85,18 +133,57 @@ def create_distribution_package():
     print(f"Distribution package created: {package_dir}")
     return package_dir
 
+def bundle_ollama_model(package_dir, model=OLLAMA_MODEL):
+    """Copy the model manifest and the blobs it references into package_dir/ollama_model"""
+    print(f"Bundling Ollama model {model}...")
+    if subprocess.run(['ollama', 'pull', model]).returncode != 0:
+        print(f"Warning: could not pull {model}, launchers will download it on first run")
+        return False
+    
+    models_dir = Path(os.environ.get('OLLAMA_MODELS', Path.home() / '.ollama' / 'models'))
+    name, _, tag = model.partition(':')
+    manifest_rel = Path('manifests') / 'registry.ollama.ai' / 'library' / name / (tag or 'latest')
+    manifest_path = models_dir / manifest_rel
+    if not manifest_path.exists():
+        print(f"Warning: manifest not found at {manifest_path}")
+        return False
+    
+    target_dir = package_dir / 'ollama_model'
+    (target_dir / manifest_rel).parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(manifest_path, target_dir / manifest_rel)
+    
+    # Only the layers this model uses, not every blob on the build host
+    manifest = json.loads(manifest_path.read_text())
+    (target_dir / 'blobs').mkdir(exist_ok=True)
+    for layer in [manifest['config']] + manifest['layers']:
+        blob_name = layer['digest'].replace(':', '-')
+        _link_or_copy(models_dir / 'blobs' / blob_name, target_dir / 'blobs' / blob_name)
+    
+    print(f"Bundled {model} into {target_dir}")
+    return True
+
 def create_launcher_scripts(package_dir, system):
     """Create simple launcher scripts"""
     if system == "windows":
         launcher_content = '''@echo off
 echo Starting Text-to-3D CAD Generator...
 
+REM Bundle contents are read-only bytecode; don't try to write .pyc caches
+set PYTHONDONTWRITEBYTECODE=1
+
 REM Check if Ollama is running
 tasklist /FI "IMAGENAME eq ollama.exe" 2>NUL | find /I /N "ollama.exe">NUL
 if "%ERRORLEVEL%"=="1" (
+    REM Serve from the bundled model store if the package ships one
+    if exist "%~dp0ollama_model" set OLLAMA_MODELS=%~dp0ollama_model
     echo Starting Ollama service...
     start /B ollama serve
     timeout /t 5 >nul
+) else (
+    if exist "%~dp0ollama_model" (
+        echo Warning: Ollama is already running, so the bundled model is not used.
+        echo Quit Ollama and relaunch to use it instead of downloading the model.
+    )
 )
 
 REM Check if model exists
@@ -117,6 +204,9 @@ start "" "Text-to-3D\\Text-to-3D.exe"
         launcher_content = '''#!/bin/bash
 echo "Starting Text-to-3D CAD Generator..."
 
+# Bundle contents are read-only bytecode; don't try to write .pyc caches
+export PYTHONDONTWRITEBYTECODE=1
+
 # Check if Ollama is installed
 if ! command -v ollama &> /dev/null; then
     echo "Ollama not found. Please install Ollama first:"
@@ -124,11 +214,20 @@ if ! command -v ollama &> /dev/null; then
     exit 1
 fi
 
-# Start Ollama if not running
+BUNDLED_MODELS="$(cd "$(dirname "$0")" && pwd)/ollama_model"
+
+# Start Ollama if not running, serving from the bundled model store if present
 if ! pgrep -x "ollama" > /dev/null; then
     echo "Starting Ollama service..."
-    ollama serve &
+    if [ -d "$BUNDLED_MODELS" ]; then
+        OLLAMA_MODELS="$BUNDLED_MODELS" ollama serve &
+    else
+        ollama serve &
+    fi
     sleep 5
+elif [ -d "$BUNDLED_MODELS" ]; then
+    echo "Warning: Ollama is already running, so the bundled model is not used."
+    echo "Quit Ollama and relaunch to use it instead of downloading the model."
 fi
 
 # Check if model exists
@@ -156,7 +255,7 @@ def create_package_info(package_dir, system):
     """Create package information file"""
     info_content = f'''Text-to-3D CAD Generator - Distribution Package
 Platform: {system}
-Build Date: {subprocess.check_output(['date'], shell=True, text=True).strip()}
+Build Date: {datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}
 
 QUICK START:
 1. Extract all files to a folder
@@ -184,6 +283,50 @@ Built with ❤️ for the maker community
     with open(package_dir / "PACKAGE_INFO.txt", 'w') as f:
         f.write(info_content)
 
+def _is_upx_packed(file_path, data=None):
+    """UPX leaves its 'UPX!' marker in the first few KB of a packed binary"""
+    if data is None:
+        with open(file_path, 'rb') as f:
+            data = f.read(4096)
+    return b'UPX!' in data[:4096]
+
+def _zip_compression(file_path, data=None):
+    """Pick the ZIP compression method for a file by extension"""
+    # Deflate only: Explorer's built-in extractor can't open LZMA entries
+    suffix = file_path.suffix.lower()
+    if suffix in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    if (suffix in NATIVE_EXTENSIONS or '.so.' in file_path.name) and _is_upx_packed(file_path, data):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def _scan_files(root):
+    """Recursively yield files under root using os.scandir"""
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_files(entry.path)
+            elif entry.is_file():
+                yield Path(entry.path)
+
+def _read_ahead(file_path):
+    """Read a small file in a worker thread; large files are streamed by the writer"""
+    if file_path.stat().st_size > ZIP_PREFETCH_LIMIT:
+        return None
+    return file_path.read_bytes()
+
+def _write_zip_entry(zipf, package_dir, file_path, data):
+    """Write one file into the archive, from prefetched bytes when available"""
+    arcname = str(file_path.relative_to(package_dir.parent))
+    compress_type = _zip_compression(file_path, data)
+    if data is None:
+        zipf.write(file_path, arcname, compress_type=compress_type, compresslevel=9)
+        return
+    
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    zinfo.compress_type = compress_type
+    zipf.writestr(zinfo, data, compresslevel=9)
+
 def create_zip_package(package_dir):
     """Create a ZIP file of the distribution package"""
     zip_name = f"{package_dir.name}.zip"
@@ -191,12 +334,20 @@ def create_zip_package(package_dir):
     
     print(f"Creating ZIP package: {zip_name}")
     
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(package_dir):
-            for file in files:
-                file_path = Path(root) / file
-                arcname = file_path.relative_to(package_dir.parent)
-                zipf.write(file_path, arcname)
+    # Worker threads scan and read ahead while the single writer compresses
+    workers = os.cpu_count() or 4
+    with ThreadPoolExecutor(max_workers=workers) as pool, \
+            zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        pending = deque()
+        for file_path in _scan_files(package_dir):
+            pending.append((file_path, pool.submit(_read_ahead, file_path)))
+            if len(pending) >= workers * 4:
+                file_path, future = pending.popleft()
+                _write_zip_entry(zipf, package_dir, file_path, future.result())
+        
+        while pending:
+            file_path, future = pending.popleft()
+            _write_zip_entry(zipf, package_dir, file_path, future.result())
     
     print(f"ZIP package created: {zip_path}")
     print(f"Package size: {zip_path.stat().st_size / (1024*1024):.1f} MB")
@@ -1,27 +1,109 @@
 # interfaces/desktop_app.py
 """Enhanced RAG + Intelligent Reasoning Desktop Application with RAG Toggle"""
 import customtkinter as ctk
-import threading
+import hashlib
+import json
 import os
+import re
+import threading
+from collections import ChainMap, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from tkinter import messagebox
 from pathlib import Path
 from dotenv import load_dotenv
 
-from src.llm_engine import LLMEngine
-from src.assistant import IntelligentConversationAssistant
-from src.generation.RAG_generator import EnhancedRAGCADGenerator
-from src.generation.export import ModelExporter
-
 # Load environment variables
 load_dotenv()
 
+# Example requests from the welcome message plus common CAD terms, embedded
+# and searched once during init so the first real query runs warm
+COMMON_QUERIES = ["20 tooth gear", "phone stand", "novel device",
+                  "gear", "bracket", "knob", "enclosure", "screw"]
+
+# Numbers in a chat message; a cached reply is reused only when they all match
+_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+
+# Dimension line of the generation message; missing dimensions show as '?'
+_DIMS_TEMPLATE = "{width} × {depth} × {height} mm"
+_DIMS_DEFAULTS = {'width': '?', 'depth': '?', 'height': '?'}
+
+# Recently generated models kept for re-requests of an identical spec
+MODEL_CACHE_SIZE = 8
+
+# Oldest chat lines are dropped beyond this so long sessions stay responsive
+MAX_CHAT_LINES = 2000
+
+# Marks the model spec at the end of an assistant reply (never displayed)
+_SENTINEL = 'GENERATE_MODEL:'
+_SENTINEL_RE = re.compile(re.escape(_SENTINEL))
+
+def _visible_reply(raw: str, final: bool) -> str:
+    """Part of a (possibly partial) reply to display: the text before the sentinel"""
+    text = raw.lstrip()
+    m = _SENTINEL_RE.search(text)
+    if m:
+        text = text[:m.start()]
+    elif not final:
+        # Hold back a tail that may turn out to be the start of the sentinel
+        for k in range(min(len(text), len(_SENTINEL) - 1), 0, -1):
+            if _SENTINEL.startswith(text[-k:]):
+                text = text[:-k]
+                break
+    return text.rstrip() if final else text
+
 class EnhancedDesktopApp:
     def __init__(self):
+        # Shared worker pool for init, chat and generation
+        self._io_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-io")
+        # View / export get their own single worker: a long CAD render never holds
+        # up chat, and two OCC operations never touch the same model at once
+        self._cad_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cad-io")
+        self._pending = set()
+        self._inflight = {}  # button action -> its running future
+        
+        # Chat messages added within one event-loop tick are inserted together
+        self._chat_buf = []
+        self._chat_flush_scheduled = False
+        
+        # Assistant reply streamed into the chat: raw chunks from the worker,
+        # characters already shown, and the last request whose stream was closed
+        self._stream_req = None
+        self._stream_parts = []
+        self._stream_shown = 0
+        self._stream_closed = None
+        self._stream_flush_scheduled = False
+        
+        # The LLM request currently in flight (chat turn plus its model generation)
+        self._current_gen_req_id = None
+        self._current_gen_future = None
+        
+        # (spec, code, RAG mode) hash -> (model, code, generation info), LRU order
+        self._model_cache = OrderedDict()
+        self._model_cache_lock = threading.Lock()  # used from worker threads
+        
+        # Formatted welcome / info dialog text, rebuilt only when their inputs change
+        self._welcome_text = None
+        self._info_text = None
+        
+        # Open info dialog, reused across clicks, and the text it currently shows
+        self._info_dialog = None
+        self._info_widget = None
+        self._last_info_text = None
+        
+        # Set once the worker thread has attached the LLM / RAG components
+        self._components_ready = False
+        
         self._setup_ui()
-        self._initialize_components()
         self.current_model = None
         self.current_spec = None
+        
+        # Paint the window first; heavy components load on a worker thread
+        self.message_entry.configure(state="disabled")
+        self.send_button.configure(state="disabled")
+        self.new_button.configure(state="disabled")
+        self._set_status("⏳ Loading Enhanced RAG components...")
+        self.root.after(50, self._kick_off_init)
     
     def _setup_ui(self):
         """Initialize the enhanced user interface"""
@@ -33,6 +115,7 @@ class EnhancedDesktopApp:
         self.root = ctk.CTk()
         self.root.title("🧠 Enhanced RAG + Intelligent AI Manufacturing")
         self.root.geometry(window_size)
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
         
         # Header
         header = ctk.CTkLabel(self.root, text="🧠 Enhanced RAG + Intelligent AI Manufacturing", 
@@ -44,7 +127,8 @@ class EnhancedDesktopApp:
         main_frame.pack(fill="both", expand=True, padx=10, pady=10)
         
         # Chat display
-        self.chat_display = ctk.CTkTextbox(main_frame, height=400)
+        # Read-only transcript; only _flush_chat / new_conversation unlock it
+        self.chat_display = ctk.CTkTextbox(main_frame, height=400, state="disabled")
         self.chat_display.pack(fill="both", expand=True, padx=10, pady=10)
         
         # Input frame
@@ -90,6 +174,8 @@ class EnhancedDesktopApp:
                                        command=self.toggle_rag_mode, width=50)
         self.rag_toggle.pack(side="left", padx=(0, 10))
         self.rag_toggle.select()  # Start with RAG enabled
+        self._last_rag_state = self.rag_toggle.get()
+        self._rag_toggle_after = None
         
         self.rag_status_label = ctk.CTkLabel(rag_control_frame, text="ON", 
                                             text_color="green", font=ctk.CTkFont(weight="bold"))
@@ -101,14 +187,28 @@ class EnhancedDesktopApp:
         
         # Status
         self.status = ctk.CTkLabel(self.root, text="Ready...")
+        self._last_status_text = "Ready..."
         self.status.pack(pady=5)
     
     def toggle_rag_mode(self):
-        """Toggle RAG mode on/off"""
+        """Toggle RAG mode on/off (applied once the switch settles for 150 ms)"""
+        if self._rag_toggle_after is not None:
+            self.root.after_cancel(self._rag_toggle_after)
+        self._rag_toggle_after = self.root.after(150, self._apply_rag_mode)
+    
+    def _apply_rag_mode(self):
+        """Propagate the settled RAG switch state; double-toggles are a no-op"""
+        self._rag_toggle_after = None
         rag_enabled = self.rag_toggle.get()
+        if rag_enabled == self._last_rag_state:
+            return
+        self._last_rag_state = rag_enabled
         
-        if hasattr(self, 'generator'):
+        if self._components_ready:
             self.generator.set_rag_enabled(rag_enabled)
+            # Cached replies were produced under the other RAG mode
+            self.chat_cache.clear()
+        self._invalidate_info_text()
         
         # Update visual indicators
         if rag_enabled:
@@ -120,49 +220,96 @@ class EnhancedDesktopApp:
             status_text = "🤖 RAG disabled - using intelligent reasoning only"
             self.rag_info_button.configure(text="🤖 Intelligent Mode Info")
         
-        self.status.configure(text=status_text)
+        self._set_status(status_text)
         self._add_message("System", f"🔄 Mode changed: {'Enhanced RAG + Intelligent Reasoning' if rag_enabled else 'Intelligent Reasoning Only'}")
     
+    def _kick_off_init(self):
+        """Start component initialization once the window is on screen"""
+        self._submit(self._initialize_components)
+    
     def _initialize_components(self):
-        """Initialize Enhanced RAG + Intelligent Reasoning components"""
+        """Initialize Enhanced RAG + Intelligent Reasoning components (worker thread)"""
         try:
+            # Heavy imports (CadQuery, torch, FAISS) are deferred until the UI is up
+            from src.llm_engine import LLMEngine
+            from src.assistant import IntelligentConversationAssistant
+            from src.generation.RAG_generator import EnhancedRAGCADGenerator
+            from src.generation.export import ModelExporter
+            from src.cache.semantic_cache import SemanticQueryCache
+            
             model_name = os.getenv('DEFAULT_MODEL', 'llama3.1:8b')
             performance_mode = os.getenv('PERFORMANCE_MODE', 'balanced')
-            embedding_model = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
             
             # Initialize LLM engine
             llm_engine = LLMEngine(model_name, performance_mode)
             
             # Initialize Enhanced components
-            self.assistant = IntelligentConversationAssistant(llm_engine)
-            self.generator = EnhancedRAGCADGenerator(llm_engine)
-            self.exporter = ModelExporter(os.getenv('EXPORT_DIRECTORY', './exports'))
+            assistant = IntelligentConversationAssistant(llm_engine)
+            generator = EnhancedRAGCADGenerator(llm_engine)
+            exporter = ModelExporter(os.getenv('EXPORT_DIRECTORY', './exports'))
             
-            #Set initial RAG state from toggle
-            self.generator.set_rag_enabled(self.rag_toggle.get())
+            # Load the LLM into memory while the retriever warms up
+            self._submit(llm_engine.warm_up)
             
-            stats = self.generator.get_enhanced_rag_stats()
+            # First messages hit a warm embedding cache and an already-searched index
+            generator.embedder.warmup(list(generator.iter_reference_texts()) + COMMON_QUERIES)
+            generator.rag_library.semantic_search_multi(COMMON_QUERIES, top_k=generator.top_k)
             
-            print(f"✅ Enhanced RAG + Intelligent Reasoning system initialized:")
-            print(f"   LLM: {model_name} ({performance_mode})")
-            print(f"   Embedding: {embedding_model}")
-            print(f"   References: {stats['total_references']}")
-            print(f"   RAG Enabled: {stats['rag_enabled']}")
-            print(f"   Complexity levels: {stats['complexity_distribution']}")
-            print(f"   Categories: {stats['category_distribution']}")
+            # Opening requests that re-phrase an earlier one (after New Design) reuse its chat result
+            chat_cache = SemanticQueryCache(
+                threshold=float(os.getenv('CHAT_CACHE_THRESHOLD', '0.92')),
+                max_entries=int(os.getenv('CHAT_CACHE_SIZE', '1000'))
+            )
             
-            self._add_welcome_message()
+            self.root.after(0, self._on_components_ready, llm_engine, assistant, generator, exporter, chat_cache)
             
         except Exception as e:
-            messagebox.showerror("Enhanced RAG Initialization Error", f"Failed to start Enhanced RAG system: {e}")
+            self.root.after(0, self._on_components_failed, str(e))
     
-    def _add_welcome_message(self):
-        """Add Enhanced RAG welcome message to chat"""
+    def _on_components_ready(self, llm_engine, assistant, generator, exporter, chat_cache):
+        """Attach initialized components and enable input (Tk thread)"""
+        self.llm_engine = llm_engine
+        self.chat_cache = chat_cache
+        self.exporter = exporter
+        self.assistant = assistant
+        self.generator = generator
+        self._components_ready = True
+        
+        #Set initial RAG state from toggle
+        self.generator.set_rag_enabled(self.rag_toggle.get())
+        
         stats = self.generator.get_enhanced_rag_stats()
         
-        complexity_summary = ", ".join([f"{k}: {v}" for k, v in stats['complexity_distribution'].items()])
+        print(f"✅ Enhanced RAG + Intelligent Reasoning system initialized:")
+        print(f"   LLM: {os.getenv('DEFAULT_MODEL', 'llama3.1:8b')} ({os.getenv('PERFORMANCE_MODE', 'balanced')})")
+        print(f"   Embedding: {os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')}")
+        print(f"   References: {stats['total_references']} ({'cached' if stats['embeddings_cached'] else 'freshly computed'} embeddings)")
+        print(f"   RAG Enabled: {stats['rag_enabled']}")
+        print(f"   Complexity levels: {stats['complexity_distribution']}")
+        print(f"   Categories: {stats['category_distribution']}")
         
-        welcome = f"""🚀 Welcome to Enhanced RAG + Intelligent AI Manufacturing!
+        self._add_welcome_message(stats)
+        self._info_text = self._build_info_text()
+        
+        self.message_entry.configure(state="normal")
+        self.send_button.configure(state="normal")
+        self.new_button.configure(state="normal")
+        self._set_status("Ready...")
+    
+    def _on_components_failed(self, error: str):
+        """Report initialization failure (Tk thread)"""
+        self._set_status("❌ Enhanced RAG initialization failed")
+        messagebox.showerror("Enhanced RAG Initialization Error", f"Failed to start Enhanced RAG system: {error}")
+    
+    def _add_welcome_message(self, stats: dict = None):
+        """Add Enhanced RAG welcome message to chat"""
+        # Depends only on the reference library, so it is formatted once
+        if self._welcome_text is None:
+            stats = stats or self.generator.get_enhanced_rag_stats()
+            
+            complexity_summary = ", ".join([f"{k}: {v}" for k, v in stats['complexity_distribution'].items()])
+            
+            self._welcome_text = f"""🚀 Welcome to Enhanced RAG + Intelligent AI Manufacturing!
 
 🧠 **Enhanced RAG System Active** (Toggle: 🔲 ON/OFF):
 • **{stats['total_references']} hierarchical examples** across complexity levels
@@ -188,21 +335,57 @@ class EnhancedDesktopApp:
 
 Describe anything you want to create - toggle RAG to compare approaches!"""
         
-        self._add_message("Enhanced RAG Assistant", welcome)
+        self._add_message("Enhanced RAG Assistant", self._welcome_text)
     
     def show_enhanced_rag_info(self):
         """Show Enhanced RAG system information dialog with toggle state"""
-        if hasattr(self, 'generator'):
-            stats = self.generator.get_enhanced_rag_stats()
-            rag_enabled = self.rag_toggle.get()
+        if self._components_ready:
+            if self._info_text is None:
+                self._info_text = self._build_info_text()
+            mode_title, info_head, info_tail = self._info_text
             
-            complexity_details = '\n'.join([f"• {k.title()}: {v} examples" for k, v in stats['complexity_distribution'].items()])
-            category_details = '\n'.join([f"• {k.title()}: {v} examples" for k, v in stats['category_distribution'].items()])
+            # Only the cache counters change between generations
+            cache_stats = self.chat_cache.get_stats()
+            embedder_stats = self.generator.embedder.stats()
+            info_text = (f"{info_head}"
+                         f"• Chat Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses ({cache_stats['size']} entries)\n"
+                         f"• Embedding Cache: {embedder_stats['hit_rate']:.0%} hit rate ({embedder_stats['size']} entries)\n"
+                         f"{info_tail}")
             
-            # Different content based on RAG toggle state
-            if rag_enabled:
-                mode_title = "🧠 Enhanced RAG + Intelligent Reasoning System"
-                mode_description = f"""🎯 **Current Mode: Enhanced RAG ENABLED**
+            # Reuse the dialog if it is still open; re-render only on change
+            if self._info_dialog is not None and self._info_dialog.winfo_exists():
+                self._info_dialog.title(mode_title)
+                self._info_dialog.lift()
+            else:
+                dialog = ctk.CTkToplevel(self.root)
+                dialog.title(mode_title)
+                dialog.geometry("650x500")
+                dialog.transient(self.root)
+                
+                self._info_widget = ctk.CTkTextbox(dialog)
+                self._info_widget.pack(fill="both", expand=True, padx=20, pady=20)
+                self._info_dialog = dialog
+                self._last_info_text = None
+            
+            if info_text != self._last_info_text:
+                self._info_widget.configure(state="normal")
+                self._info_widget.delete("1.0", "end")
+                self._info_widget.insert("1.0", info_text)
+                self._info_widget.configure(state="disabled")
+                self._last_info_text = info_text
+    
+    def _build_info_text(self) -> tuple:
+        """Format the info dialog text around the live cache counters"""
+        stats = self.generator.get_enhanced_rag_stats()
+        rag_enabled = self.rag_toggle.get()
+        
+        complexity_details = '\n'.join([f"• {k.title()}: {v} examples" for k, v in stats['complexity_distribution'].items()])
+        category_details = '\n'.join([f"• {k.title()}: {v} examples" for k, v in stats['category_distribution'].items()])
+        
+        # Different content based on RAG toggle state
+        if rag_enabled:
+            mode_title = "🧠 Enhanced RAG + Intelligent Reasoning System"
+            mode_description = f"""🎯 **Current Mode: Enhanced RAG ENABLED**
 
 **Enhanced RAG Mode** (similarity ≥ {stats['similarity_threshold']:.1f}):
 • Uses hierarchical examples with complexity scaling
@@ -221,9 +404,9 @@ Describe anything you want to create - toggle RAG to compare approaches!"""
 2. **IF** similarity ≥ threshold → Enhanced RAG with hierarchical patterns
 3. **IF** similarity < threshold → Intelligent reasoning from engineering principles
 4. System always chooses the optimal approach for each design"""
-            else:
-                mode_title = "🤖 Intelligent Reasoning Only System"
-                mode_description = """🎯 **Current Mode: RAG DISABLED - Intelligent Reasoning Only**
+        else:
+            mode_title = "🤖 Intelligent Reasoning Only System"
+            mode_description = """🎯 **Current Mode: RAG DISABLED - Intelligent Reasoning Only**
 
 **Pure Intelligent Reasoning Mode**:
 • Uses LLM's engineering knowledge exclusively
@@ -244,15 +427,17 @@ Describe anything you want to create - toggle RAG to compare approaches!"""
 • Tests LLM's inherent engineering knowledge
 • Useful for novel/unprecedented designs
 • Good for comparing against RAG approaches"""
-            
-            info_text = f"""{mode_title}
+        
+        info_head = f"""{mode_title}
 
 📊 **Statistics:**
 • Total References: {stats['total_references']} (Available but {'DISABLED' if not rag_enabled else 'ENABLED'})
 • Embedding Model: {stats['embedding_model']}
 • Search Top-K: {stats['top_k']}
 • Similarity Threshold: {stats['similarity_threshold']:.2f}
-
+"""
+        
+        info_tail = f"""
 📁 **Cache Directory:**
 {stats['cache_dir']}
 
@@ -275,22 +460,46 @@ Describe anything you want to create - toggle RAG to compare approaches!"""
 • **RAG OFF**: Good for testing pure reasoning and novel designs
 • **Engineering constraints** handled by both modes
 • **Toggle anytime** to see different approaches to same problem"""
-            
-            # Create enhanced info dialog
-            dialog = ctk.CTkToplevel(self.root)
-            dialog.title(mode_title)
-            dialog.geometry("650x500")
-            dialog.transient(self.root)
-            
-            text_widget = ctk.CTkTextbox(dialog)
-            text_widget.pack(fill="both", expand=True, padx=20, pady=20)
-            text_widget.insert("1.0", info_text)
-            text_widget.configure(state="disabled")
+        
+        return mode_title, info_head, info_tail
+    
+    def _invalidate_info_text(self):
+        """Rebuild the info dialog text on next open"""
+        self._info_text = None
+    
+    def _set_status(self, text: str):
+        """Update the status bar, skipping the redraw when the text is unchanged"""
+        if text == self._last_status_text:
+            return
+        self._last_status_text = text
+        self.status.configure(text=text)
     
     def _add_message(self, sender: str, message: str):
-        """Add message to chat display"""
+        """Queue message for the chat display (flushed when Tk is idle)"""
         timestamp = datetime.now().strftime("%H:%M")
-        self.chat_display.insert("end", f"\n[{timestamp}] {sender}:\n{message}\n")
+        self._queue_chat(f"\n[{timestamp}] {sender}:\n{message}\n")
+    
+    def _queue_chat(self, text: str):
+        """Queue raw text for the chat display"""
+        self._chat_buf.append(text)
+        if not self._chat_flush_scheduled:
+            self._chat_flush_scheduled = True
+            self.root.after_idle(self._flush_chat)
+    
+    def _flush_chat(self):
+        """Insert all queued messages with a single widget update"""
+        self._chat_flush_scheduled = False
+        if not self._chat_buf:
+            return
+        self.chat_display.configure(state="normal")
+        self.chat_display.insert("end", "".join(self._chat_buf))
+        
+        # Keep only the most recent lines
+        line_count = int(self.chat_display.index("end-1c").split(".")[0])
+        if line_count > MAX_CHAT_LINES:
+            self.chat_display.delete("1.0", f"end-{MAX_CHAT_LINES} lines")
+        self.chat_display.configure(state="disabled")
+        self._chat_buf.clear()
         self.chat_display.see("end")
     
     def send_message(self, event=None):
@@ -301,74 +510,242 @@ Describe anything you want to create - toggle RAG to compare approaches!"""
         
         self._add_message("You", message)
         self.message_entry.delete(0, "end")
-        self.status.configure(text="🤔 Thinking...")
+        self._set_status("🤔 Thinking...")
         self.send_button.configure(state="disabled")
         
-        # Process in background
-        threading.Thread(target=self._process_message, args=(message,), daemon=True).start()
+        # Process in background, superseding any generation still running
+        self._abort_current()
+        self._current_gen_req_id = self.llm_engine.begin_request()
+        self._current_gen_future = self._submit(self._process_message, self._current_gen_req_id, message)
+    
+    def _submit(self, fn, *args, pool: ThreadPoolExecutor = None):
+        """Run fn on a worker pool (the shared one by default) and track it until done"""
+        future = (pool or self._io_pool).submit(fn, *args)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        return future
+    
+    def _submit_once(self, action: str, fn, *args):
+        """Submit fn to the CAD worker unless the previous run of the same action is still in flight"""
+        future = self._inflight.get(action)
+        if future is not None and not future.done():
+            return None
+        future = self._inflight[action] = self._submit(fn, *args, pool=self._cad_pool)
+        return future
+    
+    def _cancel_pending(self):
+        """Cancel queued background work that has not started yet"""
+        for future in list(self._pending):
+            future.cancel()
+    
+    def _abort_current(self):
+        """Stop the in-flight LLM request; its late results are dropped"""
+        self._close_stream(self._current_gen_req_id)
+        future = self._current_gen_future
+        if future is not None and not future.done():
+            future.cancel()
+            self.llm_engine.abort(self._current_gen_req_id)
+        self._end_current()
     
-    def _process_message(self, message: str):
+    def _end_current(self):
+        """Forget the finished request so the next message does not abort it"""
+        self._current_gen_req_id = None
+        self._current_gen_future = None
+    
+    def _is_stale(self, req_id: int) -> bool:
+        """True if a result belongs to a superseded request"""
+        if req_id != self._current_gen_req_id:
+            print(f"⏭️ Dropping result of superseded request {req_id}")
+            return True
+        return False
+    
+    def _on_close(self):
+        """Drop queued work and close the window"""
+        self._io_pool.shutdown(wait=False, cancel_futures=True)
+        self._cad_pool.shutdown(wait=False, cancel_futures=True)
+        if self._components_ready:
+            self.llm_engine.close()
+        self.root.destroy()
+    
+    def _process_message(self, req_id: int, message: str):
         """Process message with Enhanced RAG debugging"""
         try:
             print(f"🎯 Processing: '{message}'")
-            result = self.assistant.chat(message)
+            
+            # Only opening messages are cached: later replies depend on the conversation so far
+            embedding = None
+            if self.assistant.exchange_count == 0:
+                embedding = self._embed_query(message)
+                numbers = _NUMBER_RE.findall(message)
+                cached = None
+                if embedding is not None:
+                    cached = self.chat_cache.get(embedding, accept=lambda value: value['numbers'] == numbers)
+                if cached:
+                    self.assistant.restore_state(message, cached['state'])
+                    self.root.after(0, self._handle_response, json.loads(cached['result']), req_id)
+                    return
+            
+            result = self.assistant.chat(message, on_chunk=lambda chunk: self._on_reply_chunk(req_id, chunk),
+                                         request_id=req_id)
+            
+            if embedding is not None and not result['message'].startswith('Error:'):
+                self._cache_chat_result(embedding, numbers, result)
             print(f"📊 Result keys: {list(result.keys())}")
             print(f"🎯 Generate model: {result.get('generate_model', False)}")
             
-            self.root.after(0, self._handle_response, result)
+            self.root.after(0, self._handle_response, result, req_id)
         except Exception as e:
             print(f"❌ Enhanced RAG Processing error: {e}")
             import traceback
             traceback.print_exc()
-            self.root.after(0, self._handle_error, str(e))
+            self.root.after(0, self._handle_error, str(e), req_id)
+        finally:
+            self.llm_engine.end_request(req_id)
+    
+    def _embed_query(self, message: str):
+        """Embed a chat message with the RAG embedding model"""
+        try:
+            return self.generator.rag_library.embed([message])[0]
+        except Exception as e:
+            print(f"⚠️ Chat cache embedding failed: {e}")
+            return None
+    
+    def _cache_chat_result(self, embedding, numbers: list, result: dict):
+        """Cache the JSON-serializable parts of a chat result with the assistant state"""
+        try:
+            cached_result = {key: result[key] for key in ('message', 'generate_model', 'model_spec', 'cadquery_code', 'rag_references')}
+            self.chat_cache.put(embedding, {
+                'result': json.dumps(cached_result),
+                'state': self.assistant.snapshot_state(),
+                'numbers': numbers
+            })
+        except (TypeError, ValueError) as e:
+            print(f"⚠️ Chat result not cacheable: {e}")
     
-    def _handle_response(self, result: dict):
+    def _on_reply_chunk(self, req_id: int, chunk: str):
+        """Collect a streamed reply chunk (worker thread); redraws run at ~30 FPS"""
+        if req_id != self._current_gen_req_id:
+            return
+        self._stream_parts.append(chunk)
+        if not self._stream_flush_scheduled:
+            self._stream_flush_scheduled = True
+            self.root.after(33, self._flush_stream, req_id)
+    
+    def _flush_stream(self, req_id: int, final_text: str = None):
+        """Queue the newly visible part of a streamed reply (Tk thread)"""
+        self._stream_flush_scheduled = False
+        if req_id != self._current_gen_req_id or req_id == self._stream_closed:
+            return
+        
+        visible = final_text if final_text is not None else _visible_reply("".join(self._stream_parts), final=False)
+        if self._stream_req != req_id:
+            if not visible:
+                return
+            self._stream_req = req_id
+            self._stream_shown = 0
+            timestamp = datetime.now().strftime("%H:%M")
+            self._queue_chat(f"\n[{timestamp}] Enhanced RAG Assistant:\n")
+        
+        if len(visible) > self._stream_shown:
+            self._queue_chat(visible[self._stream_shown:])
+            self._stream_shown = len(visible)
+    
+    def _close_stream(self, req_id: int):
+        """End the streamed reply of req_id; its late flushes are ignored"""
+        if req_id is not None and self._stream_req == req_id:
+            self._queue_chat("\n")
+        self._stream_req = None
+        self._stream_closed = req_id
+        self._stream_parts = []
+    
+    def _handle_response(self, result: dict, req_id: int = None):
         """Handle assistant response"""
-        # Show response
-        display_message = result['message']
-        if 'GENERATE_MODEL:' in display_message:
-            display_message = display_message.split('GENERATE_MODEL:')[0].strip()
+        if self._is_stale(req_id):
+            return
         
-        if display_message:
-            self._add_message("Enhanced RAG Assistant", display_message)
+        # Show response (complete the streamed copy if the reply was streamed)
+        if self._stream_req == req_id:
+            self._flush_stream(req_id, _visible_reply(result['message'], final=True))
+        else:
+            display_message = result['message']
+            m = _SENTINEL_RE.search(display_message)
+            if m:
+                display_message = display_message[:m.start()].strip()
+            
+            if display_message:
+                self._add_message("Enhanced RAG Assistant", display_message)
+        self._close_stream(req_id)
         
         # Check if generation requested
         if result['generate_model']:
-            self.status.configure(text="🧠 Enhanced RAG analysis + Intelligent generation...")
+            self._set_status("🧠 Enhanced RAG analysis + Intelligent generation...")
             self.current_spec = result['model_spec']
-            threading.Thread(
-                target=self._generate_model,
-                args=(result['model_spec'], result['cadquery_code']),
-                daemon=True
-            ).start()
+            self._current_gen_future = self._submit(self._generate_model, req_id, result['model_spec'], result['cadquery_code'])
         else:
-            self.status.configure(text="💬 Continue chatting...")
+            self._end_current()
+            self._set_status("💬 Continue chatting...")
         
         self.send_button.configure(state="normal")
     
-    def _handle_error(self, error: str):
+    def _handle_error(self, error: str, req_id: int = None):
         """Handle error"""
+        if self._is_stale(req_id):
+            return
+        self._close_stream(req_id)
+        self._end_current()
+        
         self._add_message("Enhanced RAG Error", f"❌ {error}")
-        self.status.configure(text="❌ Enhanced RAG Error occurred")
+        self._set_status("❌ Enhanced RAG Error occurred")
         self.send_button.configure(state="normal")
     
-    def _generate_model(self, spec: dict, code: str = None):
+    def _model_key(self, spec: dict, code: str = None) -> str:
+        """Cache key for a generation request; the RAG mode is part of it"""
+        spec_hash = hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+        code_hash = hashlib.sha1((code or "").encode()).hexdigest()
+        return f"{spec_hash}:{code_hash}:{self.generator.rag_enabled}"
+    
+    def _generate_model(self, req_id: int, spec: dict, code: str = None):
         """Generate 3D model using Enhanced RAG + Intelligent Reasoning"""
         try:
-            model = self.generator.generate_model(spec, code)
-            self.current_model = model
+            key = self._model_key(spec, code)
+            with self._model_cache_lock:
+                cached = self._model_cache.get(key)
+                if cached is not None:
+                    self._model_cache.move_to_end(key)
+            if cached is not None:
+                model, self.generator.last_code, gen_info = cached
+                print("⚡ Identical spec - reusing the previously built model")
+                self.root.after(0, self._handle_generation_success, spec, model, req_id, gen_info)
+                return
+            
+            model = self.generator.generate_model(spec, code, request_id=req_id)
+            gen_info = self.generator.get_last_generation_info()
+            
+            with self._model_cache_lock:
+                self._model_cache[key] = (model, self.generator.get_last_code(), gen_info)
+                while len(self._model_cache) > MODEL_CACHE_SIZE:
+                    self._model_cache.popitem(last=False)
             
-            self.root.after(0, self._handle_generation_success, spec)
+            self.root.after(0, self._handle_generation_success, spec, model, req_id, gen_info)
         except Exception as e:
-            self.root.after(0, self._handle_generation_error, str(e))
+            self.root.after(0, self._handle_generation_error, str(e), req_id)
+        finally:
+            self.llm_engine.end_request(req_id)
     
-    def _handle_generation_success(self, spec: dict):
+    def _handle_generation_success(self, spec: dict, model, req_id: int = None, gen_info: dict = None):
         """Handle successful Enhanced RAG generation with detailed mode info"""
+        if self._is_stale(req_id):
+            return
+        self._end_current()
+        self.current_model = model
+        self._invalidate_info_text()
+        
         object_type = spec.get('object_type', 'model')
-        dims = f"{spec.get('width', '?')} × {spec.get('depth', '?')} × {spec.get('height', '?')} mm"
+        dims = _DIMS_TEMPLATE.format_map(ChainMap(spec, _DIMS_DEFAULTS))
         
         # Get enhanced generation info
-        gen_info = self.generator.get_last_generation_info()
+        if gen_info is None:
+            gen_info = self.generator.get_last_generation_info()
         rag_enabled = self.rag_toggle.get()
         
         if rag_enabled and gen_info['used_rag']:
@@ -389,14 +766,18 @@ Describe anything you want to create - toggle RAG to compare approaches!"""
         
         # Update status with enhanced mode info
         status_text = f"✅ Model ready! ({status_prefix})"
-        self.status.configure(text=status_text)
+        self._set_status(status_text)
         
         self.view_button.configure(state="normal")
         self.export_button.configure(state="normal")
         self.copy_button.configure(state="normal")
     
-    def _handle_generation_error(self, error: str):
+    def _handle_generation_error(self, error: str, req_id: int = None):
         """Handle Enhanced RAG generation error"""
+        if self._is_stale(req_id):
+            return
+        self._end_current()
+        
         code = self.generator.get_last_code()
         gen_info = self.generator.get_last_generation_info()
         rag_enabled = self.rag_toggle.get()
@@ -416,38 +797,41 @@ Describe anything you want to create - toggle RAG to compare approaches!"""
 Click "📋 Copy Code" to get the full code for manual use."""
         
         self._add_message("Enhanced RAG Assistant", message)
-        self.status.configure(text="❌ Generation failed - code available")
+        self._set_status("❌ Generation failed - code available")
         self.copy_button.configure(state="normal")
     
     def view_model(self):
         """View 3D model"""
-        if self.current_model:
-            self.status.configure(text="👁️ Opening 3D viewer...")
-            threading.Thread(target=self._view_in_background, daemon=True).start()
+        if self.current_model and self._submit_once('view', self._view_in_background):
+            self._set_status("👁️ Opening 3D viewer...")
     
     def _view_in_background(self):
         """View model in background"""
         try:
             self.generator.visualize(self.current_model)
-            self.root.after(0, lambda: self.status.configure(text="👁️ 3D viewer opened"))
+            self.root.after(0, lambda: self._set_status("👁️ 3D viewer opened"))
         except Exception as e:
-            self.root.after(0, lambda: self.status.configure(text=f"❌ View failed: {e}"))
+            self.root.after(0, lambda: self._set_status(f"❌ View failed: {e}"))
     
     def export_model(self):
         """Export model to files"""
-        if self.current_model and self.current_spec:
-            self.status.configure(text="💾 Exporting STL, STEP, and Enhanced code...")
-            threading.Thread(target=self._export_in_background, daemon=True).start()
+        if self.current_model and self.current_spec and self._submit_once('export', self._export_in_background):
+            self._set_status("💾 Exporting STL, STEP, and Enhanced code...")
     
     def _export_in_background(self):
         """Export in background"""
         try:
             cadquery_code = self.generator.get_last_code()
-            result = self.exporter.export_model(self.current_model, self.current_spec, cadquery_code)
+            result = self.exporter.export_model(self.current_model, self.current_spec, cadquery_code,
+                                                on_file_ready=self._on_export_file_ready)
             self.root.after(0, self._handle_export_success, result)
         except Exception as e:
             self.root.after(0, self._handle_export_error, str(e))
     
+    def _on_export_file_ready(self, fmt: str, path: str):
+        """Report each exported file as soon as it is written"""
+        self.root.after(0, lambda: self._set_status(f"💾 {fmt} written: {Path(path).name}"))
+    
     def _handle_export_success(self, result: dict):
         """Handle successful export"""
         files = result['files']
@@ -457,12 +841,12 @@ Click "📋 Copy Code" to get the full code for manual use."""
         
         message = f"💾 Enhanced RAG Export successful!\n\n{file_list}\n\nFile size: {size:.2f} MB"
         self._add_message("Enhanced RAG Assistant", message)
-        self.status.configure(text="✅ Enhanced Export complete!")
+        self._set_status("✅ Enhanced Export complete!")
     
     def _handle_export_error(self, error: str):
         """Handle export error"""
         self._add_message("Enhanced RAG Assistant", f"❌ Export failed: {error}")
-        self.status.configure(text="❌ Export failed")
+        self._set_status("❌ Export failed")
     
     def copy_code(self):
         """Copy Enhanced RAG generated code to clipboard"""
@@ -470,20 +854,28 @@ Click "📋 Copy Code" to get the full code for manual use."""
         if code:
             self.root.clipboard_clear()
             self.root.clipboard_append(code)
-            self.status.configure(text="📋 Enhanced RAG Code copied!")
+            self._set_status("📋 Enhanced RAG Code copied!")
     
     def new_conversation(self):
         """Start new conversation"""
+        if not self._components_ready:
+            return
         if messagebox.askyesno("New Design", "Start new design? Current conversation will be lost."):
+            self._abort_current()
+            self._cancel_pending()
             self.assistant.reset()
+            self._chat_buf.clear()
+            self.chat_display.configure(state="normal")
             self.chat_display.delete("1.0", "end")
+            self.chat_display.configure(state="disabled")
             self._add_welcome_message()
             self.current_model = None
             self.current_spec = None
             self.view_button.configure(state="disabled")
             self.export_button.configure(state="disabled")
             self.copy_button.configure(state="disabled")
-            self.status.configure(text="Ready for new Enhanced RAG design...")
+            self.send_button.configure(state="normal")
+            self._set_status("Ready for new Enhanced RAG design...")
     
     def run(self):
         """Start the Enhanced application"""
@@ -5,7 +5,17 @@ import os
 import time
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from desktop_app import EnhancedDesktopApp
+# Frozen builds keep the embeddings side-pack next to the executable; set before
+# .env is loaded so it takes precedence over the source-tree relative default
+if getattr(sys, 'frozen', False):
+    os.environ.setdefault('EMBEDDING_CACHE_DIR', os.path.join(os.path.dirname(sys.executable), 'embeddings'))
+
+# Splash screen is only available in frozen builds made with a splash image
+try:
+    import pyi_splash
+    pyi_splash.update_text("Loading CAD and AI libraries...")
+except ImportError:
+    pyi_splash = None
 
 def main():
     print("🚀 Starting Enhanced RAG + Intelligent Reasoning AI Manufacturing Pipeline...")
@@ -19,7 +29,12 @@ def main():
         print("   • Setting up enhanced semantic search...")
         print("   • Preparing intelligent reasoning system...")
         
+        # Imported after the banner so it prints before customtkinter loads
+        from desktop_app import EnhancedDesktopApp
+        
         app = EnhancedDesktopApp()
+        if pyi_splash:
+            pyi_splash.close()
         app.run()
     except KeyboardInterrupt:
         print("\n👋 Goodbye!")
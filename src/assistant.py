@@ -2,21 +2,13 @@
 """Enhanced Intelligent Conversation Assistant with Object-First RAG Flow"""
 import json
 import re
+import threading
+from collections import deque
+from functools import lru_cache
 from typing import Dict, Optional, List, Tuple
 
-class IntelligentConversationAssistant:
-    def __init__(self, llm_engine, rag_generator=None):
-        self.llm_engine = llm_engine
-        self.rag_generator = rag_generator  # Access to RAG for immediate search
-        self.conversation_history = []
-        self.exchange_count = 0
-        self.detected_object = None
-        self.relevant_references = []
-        self.extracted_parameters = {}
-        self.system_prompt = self._build_intelligent_system_prompt()
-        
-    def _build_intelligent_system_prompt(self) -> str:
-        return """You are a helpful 3D design assistant using OBJECT-FIRST conversation flow.
+# Same for every conversation; leads every prompt
+_SYSTEM_PROMPT = """You are a helpful 3D design assistant using OBJECT-FIRST conversation flow.
 
 WORKFLOW:
 1. IMMEDIATELY identify the object type from user's first message
@@ -33,15 +25,214 @@ RULES:
 
 GENERATION TRIGGER:
 When ready, respond with: GENERATE_MODEL: {flat JSON structure}
+Use strict JSON: double-quoted keys and strings, no trailing commas.
 
 The JSON must include object_type and relevant parameters discovered from RAG.
 
 Keep it simple and focused on the specific object's needs."""
 
-    def chat(self, user_message: str) -> Dict:
-        """Process user message with object-first RAG flow"""
+# Conversation lines shown to the model as context
+CONTEXT_WINDOW_LINES = 10
+
+# Follow-up messages up to this length ("yes", "make it 30mm") are drafted by the small model
+SHORT_TURN_CHARS = 40
+
+# Object type mappings, in priority order
+_OBJECT_KEYWORDS = {
+    'gear': ['gear', 'cog', 'sprocket', 'pinion'],
+    'spring': ['spring', 'coil', 'helix'],
+    'container': ['container', 'box', 'storage', 'holder', 'organizer'],
+    'cup': ['cup', 'mug', 'glass', 'tumbler'],
+    'bracket': ['bracket', 'mount', 'support', 'holder'],
+    'stand': ['stand', 'holder', 'support', 'dock'],
+    'hook': ['hook', 'hanger', 'peg'],
+    'fastener': ['bolt', 'screw', 'nut', 'fastener', 'thread'],
+    'hinge': ['hinge', 'joint', 'pivot'],
+    'ring': ['ring', 'band', 'loop', 'annulus'],
+    'coaster': ['coaster', 'mat', 'pad'],
+    'sphere': ['sphere', 'ball', 'orb'],
+    'cylinder': ['cylinder', 'tube', 'pipe', 'rod']
+}
+_OBJECT_PRIORITY = {obj_type: i for i, obj_type in enumerate(_OBJECT_KEYWORDS)}
+
+# Keyword -> object type; a keyword listed twice belongs to the earlier type
+_KEYWORD_TO_OBJECT = {}
+for _obj_type, _keywords in _OBJECT_KEYWORDS.items():
+    for _keyword in _keywords:
+        _KEYWORD_TO_OBJECT.setdefault(_keyword, _obj_type)
+_KEYWORDS = frozenset(_KEYWORD_TO_OBJECT)
+
+_WORD_RE = re.compile(r'[a-z]+')
+
+# Conversation words (parameter names keep their underscores) and negations
+_CONV_TOKEN_RE = re.compile(r'\w+')
+_NEGATION_RE = re.compile(r"\b(?:no|without|don't)\b")
+
+# Unknown object named in a request ("make a widget")
+_OBJECT_RE = re.compile(r'(?:make|create|design|want|need)\s+(?:a|an|some)?\s*(\w+)')
+
+# Parameter assignments in reference code: name, then a number or a quoted string
+_ASSIGN_RE = re.compile(r'(\w+)\s*=\s*(?:(\d+(?:\.\d+)?)|["\']([^"\']+)["\'])')
+
+# Keyword sets matched as substrings; each is one alternation so a test is a single scan
+_QUERY_FEATURES = ['handle', 'lid', 'holes', 'threads', 'adjustable', 'snap', 'round', 'square']
+_QUERY_FEATURE_RE = re.compile('|'.join(_QUERY_FEATURES))
+
+# Parameter names worth extracting from reference code
+_PARAM_KEYWORD_RE = re.compile('|'.join([
+    # Dimensions
+    'width', 'height', 'depth', 'length', 'diameter', 'radius',
+    'thickness', 'wall_thickness', 'size',
+    # Ring-specific
+    'outer_radius', 'inner_radius', 'band_width',
+    # Features
+    'teeth', 'module', 'pitch', 'coils', 'wire_diameter',
+    'angle', 'offset', 'clearance', 'bore', 'thread',
+    # Decorative
+    'band', 'groove', 'pattern', 'decoration',
+    # Counts and spacing
+    'count', 'spacing', 'number', 'quantity'
+]))
+
+_CRITICAL_DIM_RE = re.compile('radius|diameter|height|width|depth|length|thickness')
+_DECORATIVE_RE = re.compile('band|decoration|pattern|ornament|groove')
+
+# Substrings of reference code that mark optional features
+_FEATURE_RE = re.compile(r'decorative|band_offset|band|handle =|lid|groove|pattern', re.IGNORECASE)
+
+# GENERATE_MODEL spec in a reply; parsed as strict JSON, repaired only on failure
+_SPEC_SENTINEL_RE = re.compile(r'GENERATE_MODEL:', re.IGNORECASE)
+_JSON_DECODER = json.JSONDecoder()
+_BARE_KEY_RE = re.compile(r'([{,]\s*)([A-Za-z_]\w*)(\s*:)')
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+
+# What LLMEngine.generate returns for an aborted request
+_ABORTED_REPLY = "Error: Request aborted"
+
+# Dimensions mentioned in the conversation
+_DIMENSION_RES = [
+    re.compile(r'(\d+)\s*mm'),
+    re.compile(r'(\d+)\s*cm'),
+    re.compile(r'(\d+)mm'),
+]
+
+# Multiple objects or assemblies in one request
+_MULTI_OBJECT_RES = [
+    re.compile(r'(\w+)\s+(?:and|with|plus)\s+(\w+)'),
+    re.compile(r'(\w+)\s+inside\s+(?:a|the)?\s*(\w+)'),
+    re.compile(r'(\w+)\s+attached\s+to\s+(?:a|the)?\s*(\w+)'),
+]
+
+@lru_cache(maxsize=256)
+def _parse_reference_parameters(code: str) -> Dict:
+    """Parameter names, defaults and optional features of reference code (cached per code text)"""
+    parameters = {}
+    
+    for match in _ASSIGN_RE.finditer(code):
+        param_name = match.group(1).lower()
+        # Be more inclusive in parameter detection
+        if _PARAM_KEYWORD_RE.search(param_name):
+            number, text = match.group(2, 3)
+            if number is not None:
+                parameters[param_name] = float(number)
+            else:
+                try:
+                    parameters[param_name] = float(text)
+                except ValueError:
+                    parameters[param_name] = text
+    
+    # Detect optional features in one pass over the code
+    features = {feature.lower() for feature in _FEATURE_RE.findall(code)}
+    
+    # Check for decorative bands ('band_offset' also means 'band')
+    if 'band_offset' in features or ('band' in features and 'decorative' in features):
+        parameters['has_decorative_bands'] = 'optional'
+    
+    # Check for other optional features
+    if 'handle =' in features:
+        parameters['has_handle'] = 'optional'
+    if 'lid' in features:
+        parameters['has_lid'] = 'optional'
+    if 'groove' in features:
+        parameters['has_grooves'] = 'optional'
+    if 'pattern' in features:
+        parameters['has_pattern'] = 'optional'
+    
+    return parameters
+
+def _balanced_object(text: str, start: int) -> Optional[str]:
+    """The {...} block opening at start, matched by brace depth"""
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == '{':
+            depth += 1
+        elif text[i] == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+def _parse_spec(response: str) -> Optional[Dict]:
+    """First JSON object after GENERATE_MODEL: (or a bare object_type object) in a reply"""
+    starts = []
+    match = _SPEC_SENTINEL_RE.search(response)
+    if match:
+        starts.append(response.find('{', match.end()))
+    starts.append(response.find('{"object_type"'))
+    
+    for start in starts:
+        if start < 0:
+            continue
+        try:
+            spec, _ = _JSON_DECODER.raw_decode(response, start)
+        except json.JSONDecodeError:
+            # Loose JSON from the model: single quotes, bare keys, trailing commas
+            spec_text = _balanced_object(response, start)
+            if spec_text is None:
+                continue
+            spec_text = spec_text.replace("'", '"')
+            spec_text = _BARE_KEY_RE.sub(r'\1"\2"\3', spec_text)
+            spec_text = _TRAILING_COMMA_RE.sub(r'\1', spec_text)
+            try:
+                spec = json.loads(spec_text)
+            except json.JSONDecodeError as e:
+                print(f"⚠️ JSON error: {e}")
+                continue
+        if isinstance(spec, dict):
+            return spec
+    return None
+
+class IntelligentConversationAssistant:
+    def __init__(self, llm_engine, rag_generator=None):
+        self.llm_engine = llm_engine
+        self.rag_generator = rag_generator  # Access to RAG for immediate search
+        self._clear_state()
+        # One turn at a time; reset() bumps the epoch so a turn that outlives it is dropped
+        self._chat_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._epoch = 0
+        self.system_prompt = _SYSTEM_PROMPT
+        # Every prompt starts with the system prompt (kept across reset()); pin it
+        # in Ollama's context so its KV entries survive context shifts
+        self._system_prompt_tokens = len(self.system_prompt) // 4
+    
+    def chat(self, user_message: str, on_chunk=None, request_id: int = None) -> Dict:
+        """Process user message with object-first RAG flow
+        
+        on_chunk receives the reply as it streams (a draft-model reply is not
+        streamed, since it may be discarded). request_id tags the LLM call so
+        the caller can abort it; an aborted turn leaves no trace in the
+        conversation.
+        """
+        with self._chat_lock:
+            return self._chat_turn(user_message, on_chunk, request_id)
+    
+    def _chat_turn(self, user_message: str, on_chunk, request_id: int) -> Dict:
+        """Run one exchange (chat lock held)"""
+        epoch = self._epoch
+        saved_state = self.snapshot_state()
         self.exchange_count += 1
-        self.conversation_history.append(f"User: {user_message}")
+        self._append_history(f"User: {user_message}")
         
         # STEP 1: Object-first detection on first message
         if self.exchange_count == 1:
@@ -53,9 +244,23 @@ Keep it simple and focused on the specific object's needs."""
         # Create prompt with object-specific guidance
         prompt = self._build_object_aware_prompt(user_message, context)
         
-        # Generate response
-        ai_response = self.llm_engine.generate(prompt, temperature=0.1)
-        self.conversation_history.append(f"Assistant: {ai_response}")
+        # Generate response; short follow-ups try the draft model first when one is loaded
+        if self.llm_engine.draft_model and self.exchange_count > 1 and len(user_message) <= SHORT_TURN_CHARS:
+            ai_response = self.llm_engine.generate_speculative(prompt, temperature=0.1, accept=self._draft_acceptable,
+                                                               num_keep=self._system_prompt_tokens, on_chunk=on_chunk,
+                                                               request_id=request_id)
+        else:
+            ai_response = self.llm_engine.generate(prompt, temperature=0.1, num_keep=self._system_prompt_tokens,
+                                                   on_chunk=on_chunk, request_id=request_id)
+        with self._state_lock:
+            if self._epoch != epoch:
+                # reset() ran meanwhile; undo whatever this turn wrote after it
+                self._clear_state()
+                return self._aborted_result()
+            if ai_response == _ABORTED_REPLY:
+                self._load_state(saved_state)
+                return self._aborted_result()
+            self._append_history(f"Assistant: {ai_response}")
         
         # Debug logging
         print(f"🎯 Exchange {self.exchange_count}: Object={self.detected_object}")
@@ -77,6 +282,40 @@ Keep it simple and focused on the specific object's needs."""
             'rag_references': self.relevant_references
         }
     
+    def _aborted_result(self) -> Dict:
+        """Result of a turn that was dropped from the conversation"""
+        return {
+            'message': _ABORTED_REPLY,
+            'generate_model': False,
+            'model_spec': None,
+            'cadquery_code': None,
+            'rag_references': []
+        }
+    
+    def _append_history(self, line: str):
+        """Record a conversation line and fold it into the lowercase search index"""
+        self.conversation_history.append(line)
+        self._history_window.append(line)
+        line_lower = line.lower()
+        self._conv_lower = f"{self._conv_lower} {line_lower}" if self._conv_lower else line_lower
+        self._conv_tokens.update(_CONV_TOKEN_RE.findall(line_lower))
+        self._conv_negated = self._conv_negated or _NEGATION_RE.search(line_lower) is not None
+    
+    def _index_history(self):
+        """Rebuild the context window and search index from conversation_history"""
+        self._history_window = deque(self.conversation_history, maxlen=CONTEXT_WINDOW_LINES)
+        self._conv_lower = " ".join(self.conversation_history).lower()
+        self._conv_tokens = set(_CONV_TOKEN_RE.findall(self._conv_lower))
+        self._conv_negated = _NEGATION_RE.search(self._conv_lower) is not None
+    
+    def _draft_acceptable(self, response: str) -> bool:
+        """Accept a draft reply unless it is empty or triggers generation with an unparseable spec"""
+        if not response.strip():
+            return False
+        if 'generate_model' in response.lower():
+            return self._extract_intelligent_spec(response) is not None
+        return True
+    
     def _handle_initial_object_detection(self, message: str):
         """Detect object and search RAG immediately"""
         if not self.rag_generator:
@@ -130,30 +369,17 @@ Keep it simple and focused on the specific object's needs."""
         """Extract object type from user message"""
         message_lower = message.lower()
         
-        # Object type mappings
-        object_mappings = {
-            'gear': ['gear', 'cog', 'sprocket', 'pinion'],
-            'spring': ['spring', 'coil', 'helix'],
-            'container': ['container', 'box', 'storage', 'holder', 'organizer'],
-            'cup': ['cup', 'mug', 'glass', 'tumbler'],
-            'bracket': ['bracket', 'mount', 'support', 'holder'],
-            'stand': ['stand', 'holder', 'support', 'dock'],
-            'hook': ['hook', 'hanger', 'peg'],
-            'fastener': ['bolt', 'screw', 'nut', 'fastener', 'thread'],
-            'hinge': ['hinge', 'joint', 'pivot'],
-            'ring': ['ring', 'band', 'loop', 'annulus'],
-            'coaster': ['coaster', 'mat', 'pad'],
-            'sphere': ['sphere', 'ball', 'orb'],
-            'cylinder': ['cylinder', 'tube', 'pipe', 'rod']
-        }
+        # Whole words plus their singular forms ("gears", "boxes")
+        tokens = set(_WORD_RE.findall(message_lower))
+        tokens |= {token[:-2] for token in tokens if token.endswith('es')}
+        tokens |= {token[:-1] for token in tokens if token.endswith('s')}
         
-        for obj_type, keywords in object_mappings.items():
-            if any(keyword in message_lower for keyword in keywords):
-                return obj_type
+        hits = tokens & _KEYWORDS
+        if hits:
+            return min((_KEYWORD_TO_OBJECT[keyword] for keyword in hits), key=_OBJECT_PRIORITY.get)
         
         # Check for custom/unknown objects
-        pattern = r'(?:make|create|design|want|need)\s+(?:a|an|some)?\s*(\w+)'
-        match = re.search(pattern, message_lower)
+        match = _OBJECT_RE.search(message_lower)
         if match:
             return match.group(1)
         
@@ -177,98 +403,44 @@ Keep it simple and focused on the specific object's needs."""
             query_parts.extend(expansions[object_type])
         
         # Add any specific features mentioned
-        feature_keywords = ['handle', 'lid', 'holes', 'threads', 'adjustable', 'snap', 'round', 'square']
-        for keyword in feature_keywords:
-            if keyword in full_message.lower():
-                query_parts.append(keyword)
+        mentioned = set(_QUERY_FEATURE_RE.findall(full_message.lower()))
+        query_parts.extend(keyword for keyword in _QUERY_FEATURES if keyword in mentioned)
         
         return ' '.join(query_parts)
     
     def _extract_parameters_from_code(self, code: str) -> Dict:
         """Extract parameter names and defaults from reference code - ENHANCED"""
-        parameters = {}
-        
-        # Pattern to find variable assignments
-        patterns = [
-            r'(\w+)\s*=\s*(\d+(?:\.\d+)?)\s*(?:#.*)?',  # number assignments
-            r'(\w+)\s*=\s*["\']([^"\']+)["\']',  # string assignments
-        ]
-        
-        # Comprehensive parameter keywords
-        param_keywords = [
-            # Dimensions
-            'width', 'height', 'depth', 'length', 'diameter', 'radius',
-            'thickness', 'wall_thickness', 'size',
-            # Ring-specific
-            'outer_radius', 'inner_radius', 'band_width', 
-            # Features
-            'teeth', 'module', 'pitch', 'coils', 'wire_diameter', 
-            'angle', 'offset', 'clearance', 'bore', 'thread',
-            # Decorative
-            'band', 'groove', 'pattern', 'decoration',
-            # Counts and spacing
-            'count', 'spacing', 'number', 'quantity'
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, code)
-            for match in matches:
-                param_name = match[0].lower()
-                # Be more inclusive in parameter detection
-                if any(keyword in param_name for keyword in param_keywords):
-                    try:
-                        parameters[param_name] = float(match[1])
-                    except:
-                        parameters[param_name] = match[1]
-        
-        # Detect optional features more comprehensively
-        code_lower = code.lower()
-        
-        # Check for decorative bands
-        if 'band' in code_lower and ('decorative' in code_lower or 'band_offset' in code_lower):
-            parameters['has_decorative_bands'] = 'optional'
-        
-        # Check for other optional features
-        if 'handle' in code_lower and 'handle =' in code_lower:
-            parameters['has_handle'] = 'optional'
-        if 'lid' in code_lower:
-            parameters['has_lid'] = 'optional'
-        if 'groove' in code_lower:
-            parameters['has_grooves'] = 'optional'
-        if 'pattern' in code_lower:
-            parameters['has_pattern'] = 'optional'
-        
-        return parameters
+        return dict(_parse_reference_parameters(code))
     
     def _build_enhanced_context(self) -> str:
         """Build context with RAG insights"""
-        context = "\n".join(self.conversation_history[-10:])
+        parts = ["\n".join(self._history_window)]
         
         if self.extracted_parameters:
-            context += f"\n\nDISCOVERED PARAMETERS FOR {self.detected_object}:\n"
-            for param, value in self.extracted_parameters.items():
-                if value == 'optional':
-                    context += f"- {param}: OPTIONAL FEATURE\n"
-                else:
-                    context += f"- {param}: {value} (default)\n"
+            parts.append(f"\n\nDISCOVERED PARAMETERS FOR {self.detected_object}:\n")
+            parts.extend(f"- {param}: OPTIONAL FEATURE\n" if value == 'optional' else f"- {param}: {value} (default)\n"
+                         for param, value in self.extracted_parameters.items())
         
         if self.relevant_references:
-            context += f"\n\nRELEVANT EXAMPLES FOUND:\n"
-            for ref_name, similarity in self.relevant_references[:2]:
-                context += f"- {ref_name} (similarity: {similarity:.3f})\n"
+            parts.append("\n\nRELEVANT EXAMPLES FOUND:\n")
+            parts.extend(f"- {ref_name} (similarity: {similarity:.3f})\n"
+                         for ref_name, similarity in self.relevant_references[:2])
         
-        return context
+        return "".join(parts)
     
     def _build_object_aware_prompt(self, user_message: str, context: str) -> str:
         """Build prompt with object-specific guidance"""
+        # Stable parts first: system prompt, object and the append-only history form a
+        # prefix shared with the previous turn, so the backend can reuse its KV cache
         prompt = f"""{self.system_prompt}
 
 DETECTED OBJECT: {self.detected_object or 'unknown'}
-EXCHANGE COUNT: {self.exchange_count}
 
 CONVERSATION CONTEXT:
 {context}
 
+EXCHANGE COUNT: {self.exchange_count}
+
 INTELLIGENT GUIDANCE:
 """
     
@@ -282,7 +454,7 @@ INTELLIGENT GUIDANCE:
                 param_lower = param.lower()
                 
                 # Identify critical dimensions
-                if any(dim in param_lower for dim in ['radius', 'diameter', 'height', 'width', 'depth', 'length', 'thickness']):
+                if _CRITICAL_DIM_RE.search(param_lower):
                     if 'inner' in param_lower or 'outer' in param_lower:
                         critical_params.append(param)  # Inner/outer are critical
                     elif 'wall' not in param_lower:  # Wall thickness is less critical
@@ -293,17 +465,12 @@ INTELLIGENT GUIDANCE:
                     optional_features.append(param)
                 
                 # Identify decorative elements
-                elif any(dec in param_lower for dec in ['band', 'decoration', 'pattern', 'ornament', 'groove']):
+                elif _DECORATIVE_RE.search(param_lower):
                     decorative_params.append(param)
             
-            # Build smart questioning strategy
-            full_conversation = " ".join(self.conversation_history).lower()
-            params_mentioned = []
-            
             # Check what's already been discussed
-            for param in critical_params + optional_features + decorative_params:
-                if param.replace('_', ' ') in full_conversation or param in full_conversation:
-                    params_mentioned.append(param)
+            params_mentioned = [param for param in critical_params + optional_features + decorative_params
+                                if param in self._conv_tokens or param.replace('_', ' ') in self._conv_lower]
             
             # Determine what to ask next
             unasked_critical = [p for p in critical_params if p not in params_mentioned]
@@ -357,75 +524,55 @@ Include all known parameters in GENERATE_MODEL JSON.
     
     def _extract_intelligent_spec(self, response: str) -> Optional[Dict]:
         """Extract GENERATE_MODEL specification with smart parsing"""
-        patterns = [
-            r'GENERATE_MODEL:\s*(\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\})',
-            r'GENERATE_MODEL:\s*(\{[\s\S]*?\})',
-            r'(\{"object_type"[^}]*\})',
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, response, re.DOTALL | re.IGNORECASE)
-            for match in matches:
-                try:
-                    spec_text = match.strip()
-                    # Clean JSON
-                    spec_text = re.sub(r'(\w+):', r'"\1":', spec_text)
-                    spec_text = spec_text.replace("'", '"')
-                    spec_text = re.sub(r',\s*}', '}', spec_text)
-                    
-                    spec = json.loads(spec_text)
-                    
-                    # Ensure object_type is set
-                    if 'object_type' not in spec and self.detected_object:
-                        spec['object_type'] = self.detected_object
-                    
-                    # Check conversation for feature removals/adaptations needed
-                    full_conversation = " ".join(self.conversation_history).lower()
-                    adaptation_needed = False
-                    
-                    # Check for handle removal
-                    if 'no handle' in full_conversation or 'without handle' in full_conversation:
-                        spec['has_handle'] = False
-                        adaptation_needed = True
-                        # Remove handle-related parameters
-                        handle_params = ['handle_width', 'handle_height', 'handle_thickness', 
-                                    'handle_arc_radius', 'handle_offset_from_top', 
-                                    'handle_path_width', 'handle_path_height']
-                        for param in handle_params:
-                            spec.pop(param, None)
-                    
-                    # Check for other feature removals
-                    if 'no lid' in full_conversation or 'without lid' in full_conversation:
-                        spec['has_lid'] = False
-                        adaptation_needed = True
-                    
-                    if 'no holes' in full_conversation or 'solid' in full_conversation:
-                        spec['has_holes'] = False
-                        adaptation_needed = True
-                    
-                    # Add extracted parameters as defaults (only if not removed)
-                    for param, value in self.extracted_parameters.items():
-                        if param not in spec and value != 'optional':
-                            # Don't add handle params if no handle
-                            if 'handle' in param and spec.get('has_handle') == False:
-                                continue
-                            spec[param] = value
-                    
-                    # Add reference info and adaptation flag
-                    if self.relevant_references:
-                        spec['_rag_reference'] = self.relevant_references[0][0]
-                        spec['_rag_similarity'] = self.relevant_references[0][1]
-                        spec['_adaptation_needed'] = adaptation_needed  # Set this flag!
-                    
-                    print(f"✅ Extracted intelligent spec: {spec}")
-                    print(f"🔧 Adaptation needed: {adaptation_needed}")
-                    return spec
-                    
-                except json.JSONDecodeError as e:
-                    print(f"⚠️ JSON error: {e}")
+        spec = _parse_spec(response)
+        if spec is None:
+            return None
+        
+        # Ensure object_type is set
+        if 'object_type' not in spec and self.detected_object:
+            spec['object_type'] = self.detected_object
+        
+        # Check conversation for feature removals/adaptations needed
+        full_conversation = self._conv_lower
+        adaptation_needed = False
+        
+        # Check for handle removal
+        if 'no handle' in full_conversation or 'without handle' in full_conversation:
+            spec['has_handle'] = False
+            adaptation_needed = True
+            # Remove handle-related parameters
+            handle_params = ['handle_width', 'handle_height', 'handle_thickness', 
+                        'handle_arc_radius', 'handle_offset_from_top', 
+                        'handle_path_width', 'handle_path_height']
+            for param in handle_params:
+                spec.pop(param, None)
+        
+        # Check for other feature removals
+        if 'no lid' in full_conversation or 'without lid' in full_conversation:
+            spec['has_lid'] = False
+            adaptation_needed = True
+        
+        if 'no holes' in full_conversation or 'solid' in full_conversation:
+            spec['has_holes'] = False
+            adaptation_needed = True
+        
+        # Add extracted parameters as defaults (only if not removed)
+        for param, value in self.extracted_parameters.items():
+            if param not in spec and value != 'optional':
+                # Don't add handle params if no handle
+                if 'handle' in param and spec.get('has_handle') == False:
                     continue
+                spec[param] = value
         
-        return None
+        # Add reference info and adaptation flag
+        if self.relevant_references:
+            spec['_rag_reference'] = self.relevant_references[0][0]
+            spec['_rag_similarity'] = self.relevant_references[0][1]
+            spec['_adaptation_needed'] = adaptation_needed  # Set this flag!
+        
+        print(f"✅ Extracted intelligent spec: {spec}")
+        print(f"🔧 Adaptation needed: {adaptation_needed}")
+        return spec
     
     def _create_smart_fallback_spec(self) -> Dict:
         """Create intelligent fallback using RAG insights - ENHANCED"""
@@ -433,7 +580,7 @@ Include all known parameters in GENERATE_MODEL JSON.
             "object_type": self.detected_object or "custom_object"
         }
         
-        full_conversation = " ".join(self.conversation_history).lower()
+        full_conversation = self._conv_lower
         
         # Use extracted parameters as base but be selective
         if self.extracted_parameters:
@@ -443,7 +590,7 @@ Include all known parameters in GENERATE_MODEL JSON.
                     # Check if feature was requested
                     feature_name = param.replace('has_', '').replace('_', ' ')
                     if feature_name in full_conversation:
-                        if any(neg in full_conversation for neg in ['no', 'without', "don't"]):
+                        if self._conv_negated:
                             spec[param] = False
                         else:
                             spec[param] = True
@@ -451,7 +598,7 @@ Include all known parameters in GENERATE_MODEL JSON.
                     continue
                 
                 # Skip decorative parameters unless mentioned
-                if any(dec in param for dec in ['band', 'decoration', 'pattern', 'groove']):
+                if _DECORATIVE_RE.search(param):
                     if param.replace('_', ' ') not in full_conversation:
                         continue  # Skip unmentioned decorative elements
                 
@@ -459,16 +606,9 @@ Include all known parameters in GENERATE_MODEL JSON.
                 spec[param] = value
         
         # Extract dimensions from conversation
-        dimension_patterns = [
-            r'(\d+)\s*mm',
-            r'(\d+)\s*cm',
-            r'(\d+)mm',
-        ]
-        
         found_dimensions = []
-        for pattern in dimension_patterns:
-            matches = re.findall(pattern, full_conversation)
-            found_dimensions.extend([int(m) for m in matches])
+        for pattern in _DIMENSION_RES:
+            found_dimensions.extend(int(m) for m in pattern.findall(full_conversation))
         
         # Object-specific intelligent assignment
         if self.detected_object == 'ring' and found_dimensions:
@@ -530,16 +670,9 @@ Include all known parameters in GENERATE_MODEL JSON.
         """Detect if user wants multiple objects or assembly"""
         objects = []
         
-        # Patterns for multiple objects
-        multi_patterns = [
-            r'(\w+)\s+(?:and|with|plus)\s+(\w+)',
-            r'(\w+)\s+inside\s+(?:a|the)?\s*(\w+)',
-            r'(\w+)\s+attached\s+to\s+(?:a|the)?\s*(\w+)',
-        ]
-        
-        for pattern in multi_patterns:
-            matches = re.findall(pattern, message.lower())
-            for match in matches:
+        message_lower = message.lower()
+        for pattern in _MULTI_OBJECT_RES:
+            for match in pattern.findall(message_lower):
                 objects.extend(match)
         
         # Clean and validate objects
@@ -553,9 +686,40 @@ Include all known parameters in GENERATE_MODEL JSON.
     
     def reset(self):
         """Reset conversation state"""
+        with self._state_lock:
+            self._epoch += 1
+            self._clear_state()
+        print("🔄 Intelligent conversation reset")
+    
+    def _clear_state(self):
+        """Empty conversation state"""
         self.conversation_history = []
+        self._index_history()
         self.exchange_count = 0
         self.detected_object = None
         self.relevant_references = []
         self.extracted_parameters = {}
-        print("🔄 Intelligent conversation reset")
+    
+    def snapshot_state(self) -> Dict:
+        """JSON-serializable copy of the conversation state"""
+        return {
+            'conversation_history': list(self.conversation_history),
+            'exchange_count': self.exchange_count,
+            'detected_object': self.detected_object,
+            'relevant_references': [list(ref) for ref in self.relevant_references],
+            'extracted_parameters': dict(self.extracted_parameters)
+        }
+    
+    def restore_state(self, user_message: str, state: Dict):
+        """Adopt a cached first-exchange state, recording the user's own wording"""
+        with self._chat_lock, self._state_lock:
+            self._load_state(dict(state, conversation_history=[f"User: {user_message}"] + state['conversation_history'][1:]))
+    
+    def _load_state(self, state: Dict):
+        """Adopt a snapshot_state() copy"""
+        self.conversation_history = list(state['conversation_history'])
+        self._index_history()
+        self.exchange_count = state['exchange_count']
+        self.detected_object = state['detected_object']
+        self.relevant_references = [tuple(ref) for ref in state['relevant_references']]
+        self.extracted_parameters = dict(state['extracted_parameters'])
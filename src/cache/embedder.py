@@ -0,0 +1,105 @@
+# src/cache/embedder.py
+"""Content-hash keyed LRU cache in front of an embedding function"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+class CachedEmbedder:
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], cache_capacity: int = 2000,
+                 cache_ttl: Optional[float] = None):
+        self.encode_fn = encode_fn
+        self.cache_capacity = cache_capacity
+        self.cache_ttl = cache_ttl
+        
+        self._cache = OrderedDict()  # sha256(text) -> (embedding, stored_at)
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+    
+    def _lookup(self, key: str, now: float) -> Optional[np.ndarray]:
+        """Return a live cached embedding (caller holds the lock)"""
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if self.cache_ttl is not None and now - entry[1] > self.cache_ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry[0]
+    
+    def _store(self, key: str, embedding: np.ndarray, now: float):
+        """Insert an embedding and evict past capacity (caller holds the lock)"""
+        self._cache[key] = (embedding, now)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_capacity:
+            self._cache.popitem(last=False)
+    
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Embed texts, encoding only cache misses in a single batch"""
+        keys = [self._key(text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = {}  # key -> first index needing it
+        
+        now = time.monotonic()
+        with self._lock:
+            for i, key in enumerate(keys):
+                vectors[i] = self._lookup(key, now)
+                if vectors[i] is None:
+                    missing.setdefault(key, i)
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        
+        if missing:
+            encoded = np.asarray(self.encode_fn([texts[i] for i in missing.values()]), dtype='float32')
+            fresh = dict(zip(missing, encoded))
+            now = time.monotonic()
+            with self._lock:
+                for key, embedding in fresh.items():
+                    self._store(key, embedding, now)
+            for i, key in enumerate(keys):
+                if vectors[i] is None:
+                    vectors[i] = fresh[key]
+        
+        return np.stack(vectors) if vectors else np.empty((0, 0), dtype='float32')
+    
+    def seed(self, texts: List[str], embeddings: np.ndarray):
+        """Populate the cache with embeddings computed elsewhere"""
+        now = time.monotonic()
+        with self._lock:
+            for text, embedding in zip(texts, np.asarray(embeddings, dtype='float32')):
+                self._store(self._key(text), embedding, now)
+    
+    def warmup(self, texts: Iterable[str]) -> int:
+        """Embed any texts not yet cached; returns how many were encoded"""
+        texts = list(dict.fromkeys(texts))
+        now = time.monotonic()
+        with self._lock:
+            cold = [text for text in texts if self._lookup(self._key(text), now) is None]
+        if cold:
+            self.seed(cold, self.encode_fn(cold))
+        print(f"🔥 Embedding cache warmed: {len(cold)} encoded, {len(texts) - len(cold)} already cached")
+        return len(cold)
+    
+    def clear(self):
+        """Drop all cached embeddings"""
+        with self._lock:
+            self._cache.clear()
+    
+    def stats(self) -> Dict:
+        """Hit rate and current size"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._cache)
+        }
@@ -0,0 +1,59 @@
+# src/cache/proximity_cache.py
+"""Approximate key-value cache over L2-normalized query embeddings"""
+import threading
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+class ProximityCache:
+    def __init__(self, tau: float = 0.05, capacity: int = 256):
+        self.tau = tau  # maximum cosine distance for a hit
+        self.capacity = capacity
+        
+        self._keys = None  # (capacity, dim) ring buffer, created from the first embedding
+        self._values = []
+        self._next = 0
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, query: np.ndarray) -> Optional[Any]:
+        """Return the value cached under the nearest query within tau"""
+        with self._lock:
+            if not self._values:
+                self.misses += 1
+                return None
+            
+            dists = 1.0 - self._keys[:len(self._values)] @ query
+            i = int(dists.argmin())
+            if dists[i] > self.tau:
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            return self._values[i]
+    
+    def put(self, query: np.ndarray, value: Any):
+        """Cache a value, overwriting the oldest entry when full"""
+        with self._lock:
+            if self._keys is None:
+                self._keys = np.zeros((self.capacity, query.shape[0]), dtype='float32')
+            
+            slot = self._next
+            self._keys[slot] = query
+            if slot < len(self._values):
+                self._values[slot] = value
+            else:
+                self._values.append(value)
+            self._next = (slot + 1) % self.capacity
+    
+    def clear(self):
+        """Drop all cached entries"""
+        with self._lock:
+            self._values = []
+            self._next = 0
+    
+    def get_stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._values)}
@@ -0,0 +1,100 @@
+# src/cache/semantic_cache.py
+"""Semantic query cache using random-projection LSH over query embeddings"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+class SemanticQueryCache:
+    def __init__(self, threshold: float = 0.92, n_hash_tables: int = 8, n_bits: int = 16,
+                 max_entries: int = 1000, seed: int = 0):
+        self.threshold = threshold
+        self.n_hash_tables = n_hash_tables
+        self.n_bits = n_bits
+        self.max_entries = max_entries
+        
+        self._rng = np.random.default_rng(seed)
+        self._planes = None  # (tables, bits, dim), created from the first embedding
+        self._bit_weights = 1 << np.arange(n_bits, dtype=np.int64)
+        self._buckets = [dict() for _ in range(n_hash_tables)]
+        self._entries = OrderedDict()  # id -> (embedding, bucket keys, value)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+    
+    def _bucket_keys(self, embedding: np.ndarray) -> np.ndarray:
+        """Hash an embedding into one bucket key per table"""
+        if self._planes is None:
+            self._planes = self._rng.standard_normal(
+                (self.n_hash_tables, self.n_bits, embedding.shape[0])).astype('float32')
+        bits = (self._planes @ embedding) > 0
+        return bits.astype(np.int64) @ self._bit_weights
+    
+    def get(self, embedding: np.ndarray, accept: Optional[Callable[[Any], bool]] = None) -> Optional[Any]:
+        """Return the value of the most similar cached query above threshold
+        
+        accept, if given, rejects candidates whose value does not fit the query.
+        """
+        embedding = np.asarray(embedding, dtype='float32')
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+            
+            candidates = set()
+            for table, key in zip(self._buckets, self._bucket_keys(embedding)):
+                candidates.update(table.get(int(key), ()))
+            
+            best_id, best_sim = None, self.threshold
+            for entry_id in candidates:
+                sim = float(self._entries[entry_id][0] @ embedding)
+                if sim >= best_sim and (accept is None or accept(self._entries[entry_id][2])):
+                    best_id, best_sim = entry_id, sim
+            
+            if best_id is None:
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            print(f"⚡ Semantic query cache hit ({best_sim:.3f})")
+            return self._entries[best_id][2]
+    
+    def put(self, embedding: np.ndarray, value: Any):
+        """Store a value under a (L2-normalized) query embedding"""
+        embedding = np.asarray(embedding, dtype='float32')
+        with self._lock:
+            keys = self._bucket_keys(embedding)
+            entry_id = self._next_id
+            self._next_id += 1
+            
+            self._entries[entry_id] = (embedding, keys, value)
+            for table, key in zip(self._buckets, keys):
+                table.setdefault(int(key), set()).add(entry_id)
+            
+            if len(self._entries) > self.max_entries:
+                self._evict_oldest()
+    
+    def _evict_oldest(self):
+        """Drop the least recently used entry from the LRU and its buckets"""
+        entry_id, (_, keys, _) = self._entries.popitem(last=False)
+        for table, key in zip(self._buckets, keys):
+            bucket = table.get(int(key))
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[int(key)]
+    
+    def clear(self):
+        """Drop all cached queries"""
+        with self._lock:
+            self._entries.clear()
+            for table in self._buckets:
+                table.clear()
+    
+    def get_stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
@@ -1,14 +1,146 @@
 # src/generation/RAG_generator.py
 """Enhanced RAG CAD Generator with Intelligent Code Adaptation"""
 import cadquery as cq
+import numpy as np
+import atexit
+import hashlib
 import json
+import math
 import re
 import os
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Dict, Optional, List, Tuple
 from .reference_library import EnhancedRAGReferenceLibrary
+from ..cache.proximity_cache import ProximityCache
+
+# Globals exposed to executed CadQuery code (copied per execution)
+_SAFE_GLOBALS = {'cq': cq, 'cadquery': cq, 'math': math}
+
+# Handle-related parameter definitions stripped by direct handle removal
+_HANDLE_PARAM_RE = re.compile(r'handle_(?:width|height|thickness|arc|offset|path)', re.IGNORECASE)
+
+# Code cleaning patterns
+_MD_FENCE_RE = re.compile(r'```(?:python)?\s*\n?', re.IGNORECASE)
+_EXPLAIN_RE = re.compile(r'this code|note that|the above|explanation:|output:', re.IGNORECASE)
+
+# Parameter extraction patterns
+_NUM_ASSIGN_RE = re.compile(r'(\w+)\s*=\s*(\d+(?:\.\d+)?)\s*(?:#.*)?')
+_STR_ASSIGN_RE = re.compile(r'(\w+)\s*=\s*["\']([^"\']+)["\']')
+_PARAM_KEYWORD_RE = re.compile('|'.join([
+    'width', 'height', 'depth', 'length', 'diameter', 'radius',
+    'thickness', 'wall_thickness', 'teeth', 'module', 'pitch',
+    'coils', 'wire_diameter', 'angle', 'offset', 'clearance',
+    'bore', 'thread', 'size', 'count', 'spacing',
+    'handle_width', 'handle_height', 'handle_thickness',
+    'mug_radius', 'mug_height'
+]))
+
+# Prompt scaffolds - fixed instructions first, then reference code, then the spec,
+# so every prompt of a kind shares the longest possible prefix
+_ADAPT_HEAD = """Adapt this CadQuery code to match the new specifications.
+
+ADAPTATION RULES:
+1. Keep the overall structure and approach
+2. Update all dimension variables to match specifications
+3. COMPLETELY REMOVE code sections for features marked as False (has_handle=False means NO handle code)
+4. For has_handle=False: Remove handle creation, handle path, and handle union
+5. Add features if spec has new requirements
+6. Maintain manufacturing constraints
+7. Keep error handling but adapt it too
+
+REFERENCE CODE:
+```python
+"""
+_ADAPT_MID = """
+```
+
+NEW SPECIFICATIONS:
+"""
+_ADAPT_TAIL = """
+Generate ONLY the adapted CadQuery code (no handle if has_handle=False):"""
+
+_COMBINE_HEAD = """Combine the best patterns from these references to create the target object.
+
+COMBINATION STRATEGY:
+- Take the base structure from the most similar reference
+- Add features from other references as needed
+- Ensure all parts work together
+- Match exact specifications
+
+"""
+_COMBINE_MID = """
+
+TARGET SPECIFICATION:
+"""
+_COMBINE_TAIL = """
+
+Generate ONLY the combined CadQuery code:"""
+
+_CATEGORY_HEAD = """Use these category patterns to create a new object.
+Apply the category's design patterns and best practices.
+
+"""
+_CATEGORY_PROMPT = """CATEGORY ({category}) EXAMPLES:
+{name}: {description}
+
+TARGET: Create a {object_type} with these specifications:
+"""
+_CATEGORY_TAIL = """
+
+Generate ONLY the CadQuery code:"""
+
+_HYBRID_HEAD = """Generate CadQuery code using these design insights and engineering principles.
+Apply both the insights and your engineering knowledge to create the best solution.
+
+DESIGN INSIGHTS FROM SIMILAR OBJECTS:
+"""
+_HYBRID_MID = """
+
+TARGET SPECIFICATION:
+"""
+_HYBRID_TAIL = """
+
+Generate ONLY the CadQuery code:"""
+
+_REASONING_HEAD = """Generate CadQuery code for the specification below.
+
+Requirements:
+- Import cadquery as cq
+- Create 'result' variable
+- Include try/except fallback
+- Use appropriate CadQuery methods for this object type
+- Apply engineering principles and best practices
+- Consider 3D printing constraints
+- ONLY output executable Python code
+
+SPECIFICATION: """
+_REASONING_TAIL = """
+
+Code only:"""
+
+# Object types that belong to each reference category
+_CATEGORY_TYPES = {
+    'primitive': frozenset(['box', 'cylinder', 'sphere', 'cone']),
+    'functional': frozenset(['stand', 'holder', 'bracket', 'container', 'hook']),
+    'mathematical': frozenset(['gear', 'spring', 'thread', 'helix']),
+    'manufacturing': frozenset(['joint', 'hinge', 'snap', 'assembly'])
+}
+
+# Spec keys that describe the object rather than map to code parameters
+_DESCRIPTIVE_SPEC_KEYS = frozenset(['object_type', 'description', 'requirements', 'notes', 'has_handle'])
+
+# Design insight flags derived from reference code
+_FILLET_INSIGHT = 1
+_SHELL_INSIGHT = 2
+_BOOLEAN_INSIGHT = 4
 
 class EnhancedRAGCADGenerator:
-    def __init__(self, llm_engine, embedding_model: str = None, cache_dir: str = None):
+    def __init__(self, llm_engine, embedding_model: str = None, cache_dir: str = None,
+                 prefix_cache: bool = None):
         self.llm_engine = llm_engine
         self.last_code = ""
         self.generation_history = []
@@ -25,24 +157,100 @@ class EnhancedRAGCADGenerator:
         
         print("🧠 Initializing Enhanced RAG generator with intelligent adaptation...")
         self.rag_library = EnhancedRAGReferenceLibrary(embedding_model, cache_dir)
+        self.embedder = self.rag_library.embedder
         
         # RAG settings
         self.top_k = int(os.getenv('VECTOR_SEARCH_TOP_K', '3'))
         self.similarity_threshold = float(os.getenv('SIMILARITY_THRESHOLD', '0.3'))
+        
+        # Exact-match LLM prompt cache (LRU, persisted across runs)
+        self.prompt_cache_size = int(os.getenv('PROMPT_CACHE_SIZE', '256'))
+        self._prompt_cache_path = Path(cache_dir) / "prompt_cache.jsonl"
+        self._prompt_cache = OrderedDict()
+        self._prompt_cache_lock = threading.Lock()
+        self._load_prompt_cache()
+        atexit.register(self._save_prompt_cache)
+        
+        # Semantic cache for near-duplicate specs (ring buffer of spec embeddings)
+        self.semantic_cache_threshold = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.97'))
+        self.semantic_cache_size = int(os.getenv('SEMANTIC_CACHE_SIZE', '64'))
+        self._sem_keys = None
+        self._sem_vals = []
+        self._sem_next = 0
+        self._sem_lock = threading.Lock()  # generations can overlap
+        
+        # Approximate retrieval cache: rephrased queries reuse earlier search results
+        self._retrieval_cache = ProximityCache(
+            tau=float(os.getenv('PROXIMITY_TAU', '0.05')),
+            capacity=int(os.getenv('PROXIMITY_CACHE_SIZE', '256'))
+        )
+        
+        # Ask the engine to keep KV state for the shared prompt prefixes
+        if prefix_cache is None:
+            prefix_cache = os.getenv('PREFIX_CACHE', 'true').lower() == 'true'
+        if hasattr(llm_engine, 'set_prefix_cache'):
+            llm_engine.set_prefix_cache(prefix_cache)
+        
+        # Optional engine capabilities, probed once
+        self._can_stream = hasattr(llm_engine, 'generate_stream')
+        
+        # Print numbered code before every execution (off by default)
+        self.debug = os.getenv('RAG_DEBUG', 'false').lower() == 'true'
+        
+        # Compiled code objects for executed code, keyed by code hash
+        self._code_cache = OrderedDict()
+        
+        # Reference library statistics (invariant until embeddings are rebuilt)
+        self._library_stats = None
+        
+        # Draft independent LLM candidates concurrently when a strategy has several
+        # (off by default: on a single local Ollama device the drafts mostly serialize
+        # and only double the GPU work)
+        self.parallel_drafts = os.getenv('PARALLEL_DRAFTS', 'false').lower() == 'true'
+        
+        # Background worker for retrieval / LLM warm-up overlapping prompt assembly
+        self._pipeline_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-pipeline")
+        
+        # Per-reference analysis memo (reference code is immutable), keyed by code
+        self._reference_params = {}
+        self._reference_insights = {}
+        for reference in self.rag_library.get_all_references().values():
+            self._extract_parameters_from_code(reference['code'])
+            self._insight_flags(reference['code'])
     
     def set_rag_enabled(self, enabled: bool):
         """Enable or disable RAG mode"""
+        if enabled == self.rag_enabled:
+            return
+        self._clear_semantic_cache()
         self.rag_enabled = enabled
         mode_text = "Enhanced RAG + Intelligent Adaptation" if enabled else "Pure Intelligent Reasoning"
         print(f"🔄 Mode changed: {mode_text}")
     
-    def generate_model(self, model_spec: Dict, provided_code: Optional[str] = None) -> cq.Workplane:
-        """Generate 3D model using Enhanced RAG with intelligent adaptation"""
+    def generate_model(self, model_spec: Dict, provided_code: Optional[str] = None,
+                       request_id: int = None) -> cq.Workplane:
+        """Generate 3D model using Enhanced RAG with intelligent adaptation
+        
+        request_id tags the LLM calls so the caller can abort them.
+        """
+        spec_embedding = None
+        cache_hit = False
+        
         if provided_code:
             code = provided_code
             self.last_generation_mode = "provided"
         else:
-            code = self._generate_code_with_intelligent_adaptation(model_spec)
+            # Built once per generation and passed down (generations may overlap)
+            spec_json = self._format_spec(model_spec)
+            queries = None
+            if self.rag_enabled and '_rag_reference' not in model_spec:
+                queries = self._build_enhanced_semantic_query(model_spec)
+            
+            spec_embedding = self._embed_spec(spec_json, queries)
+            code = self._semantic_cache_lookup(spec_embedding, model_spec)
+            cache_hit = code is not None
+            if not cache_hit:
+                code = self._generate_code_with_intelligent_adaptation(model_spec, spec_json, queries, request_id)
         
         self.last_code = code
         self.generation_history.append({
@@ -53,29 +261,105 @@ class EnhancedRAGCADGenerator:
             'complexity': self.last_complexity_used
         })
         
-        return self._execute_code(code)
+        result = self._execute_code(code)
+        
+        # Only cache code that actually produced a model
+        if spec_embedding is not None and not cache_hit:
+            self._semantic_cache_store(spec_embedding, model_spec, code)
+        
+        return result
+    
+    def _embed_spec(self, spec_json: str, queries: Optional[List[str]] = None) -> Optional[np.ndarray]:
+        """Embed a model spec for semantic cache lookup
+        
+        When the turn will run a RAG search, its queries go into the same
+        encoder batch so retrieval finds them already cached.
+        """
+        texts = [spec_json]
+        if queries:
+            texts.extend(queries)
+        
+        try:
+            return self.rag_library.embed(texts)[0]
+        except Exception as e:
+            print(f"⚠️ Spec embedding failed: {e}")
+            return None
+    
+    @staticmethod
+    def _spec_values(spec: Dict) -> Tuple:
+        """Numeric and boolean spec values, which embeddings barely distinguish"""
+        return tuple(sorted((key, value) for key, value in spec.items()
+                            if isinstance(value, (int, float, bool))))
+    
+    def _semantic_cache_lookup(self, spec_embedding: Optional[np.ndarray], spec: Dict) -> Optional[str]:
+        """Return cached code for a near-identical spec with the same dimensions, if any"""
+        if spec_embedding is None:
+            return None
+        values = self._spec_values(spec)
+        
+        with self._sem_lock:
+            if not self._sem_vals:
+                return None
+            sims = self._sem_keys[:len(self._sem_vals)] @ spec_embedding
+            
+            # Most similar entry first; '{"radius":40}' and '{"radius":50}' embed almost
+            # identically, so a hit also needs every numeric value to match exactly
+            for i in np.argsort(-sims):
+                if sims[i] < self.semantic_cache_threshold:
+                    break
+                cached_values, code = self._sem_vals[i]
+                if cached_values == values:
+                    print(f"⚡ Semantic cache hit ({sims[i]:.3f}) - skipping RAG + LLM")
+                    self.last_generation_mode = "semantic_cache"
+                    return code
+        
+        return None
     
-    def _generate_code_with_intelligent_adaptation(self, spec: Dict) -> str:
+    def _semantic_cache_store(self, spec_embedding: np.ndarray, spec: Dict, code: str):
+        """Store spec embedding and code, evicting the oldest entry when full"""
+        entry = (self._spec_values(spec), code)
+        with self._sem_lock:
+            if self._sem_keys is None:
+                self._sem_keys = np.zeros((self.semantic_cache_size, spec_embedding.shape[0]), dtype='float32')
+            
+            slot = self._sem_next
+            self._sem_keys[slot] = spec_embedding
+            if slot < len(self._sem_vals):
+                self._sem_vals[slot] = entry
+            else:
+                self._sem_vals.append(entry)
+            self._sem_next = (slot + 1) % self.semantic_cache_size
+    
+    def _clear_semantic_cache(self):
+        """Drop all semantic cache entries"""
+        with self._sem_lock:
+            self._sem_vals = []
+            self._sem_next = 0
+    
+    def _generate_code_with_intelligent_adaptation(self, spec: Dict, spec_json: str,
+                                                   queries: Optional[List[str]] = None,
+                                                   request_id: int = None) -> str:
         """Generate code with intelligent reference adaptation"""
         # Check if RAG is disabled
         if not self.rag_enabled:
             print("🤖 RAG disabled - using pure intelligent reasoning")
-            prompt = self._build_intelligent_reasoning_prompt(spec)
+            prompt = self._build_intelligent_reasoning_prompt(spec_json)
             self.last_generation_mode = "intelligent_reasoning_forced"
-            return self.llm_engine.generate(prompt, temperature=0.3)
+            return self._cached_generate(prompt, temperature=0.3, request_id=request_id)
         
         # Check for pre-selected RAG reference
         if '_rag_reference' in spec:
             print(f"📎 Using pre-selected reference: {spec['_rag_reference']}")
             reference = self.rag_library.get_reference(spec['_rag_reference'])
             if spec.get('_adaptation_needed'):
-                return self._adapt_reference_code(reference, spec)
+                return self._adapt_reference_code(reference, spec, spec_json, request_id)
             else:
                 return self._use_reference_with_parameters(reference, spec)
         
         # Perform intelligent RAG search
-        query = self._build_enhanced_semantic_query(spec)
-        relevant_refs = self._intelligent_rag_search(query, spec)
+        if queries is None:
+            queries = self._build_enhanced_semantic_query(spec)
+        relevant_refs = self._intelligent_rag_search(queries, spec)
         
         # Choose generation strategy based on similarity and complexity
         if relevant_refs:
@@ -84,28 +368,156 @@ class EnhancedRAGCADGenerator:
             
             if similarity >= 0.5:  # Very good match
                 print(f"✅ Excellent match ({similarity:.3f}) - Direct adaptation")
-                return self._adapt_reference_code(best_match, spec)
+                return self._adapt_reference_code(best_match, spec, spec_json, request_id)
             elif similarity >= 0.3:  # Good match
                 print(f"✅ Good match ({similarity:.3f}) - Pattern combination")
-                return self._combine_reference_patterns(relevant_refs, spec)
+                return self._combine_reference_patterns(relevant_refs, spec, spec_json, request_id)
             elif similarity >= 0.2:  # Related match
                 print(f"🔄 Related match ({similarity:.3f}) - Category adaptation")
-                return self._adapt_category_patterns(relevant_refs, spec)
+                return self._adapt_category_patterns(relevant_refs, spec, spec_json, request_id)
             else:  # Weak match
                 print(f"⚠️ Weak match ({similarity:.3f}) - Hybrid approach")
-                return self._hybrid_generation(relevant_refs, spec)
+                return self._hybrid_generation(relevant_refs, spec_json, request_id)
         else:
             # Pure intelligent reasoning
             print("🧠 No relevant matches - Pure intelligent reasoning")
-            prompt = self._build_intelligent_reasoning_prompt(spec)
+            prompt = self._build_intelligent_reasoning_prompt(spec_json)
             self.last_generation_mode = "intelligent_reasoning"
-            return self.llm_engine.generate(prompt, temperature=0.3)
+            return self._cached_generate(prompt, temperature=0.3, request_id=request_id)
+    
+    def _format_spec(self, spec: Dict) -> str:
+        """Serialize spec as compact JSON for prompts"""
+        return json.dumps(spec, separators=(',', ':'), sort_keys=True, default=str)
+    
+    def _cached_generate(self, prompt: str, temperature: float, max_tokens: int = None,
+                         request_id: int = None) -> str:
+        """Generate with the LLM, reusing responses for identical prompts"""
+        key = self._prompt_cache_key(prompt, temperature)
+        
+        with self._prompt_cache_lock:
+            if key in self._prompt_cache:
+                self._prompt_cache.move_to_end(key)
+                print("⚡ Prompt cache hit - skipping LLM call")
+                return self._prompt_cache[key]
+        
+        response = self._stream_code(prompt, temperature, max_tokens, request_id)
+        
+        # Never cache engine errors
+        if not response.startswith("Error:"):
+            with self._prompt_cache_lock:
+                self._prompt_cache[key] = response
+                if len(self._prompt_cache) > self.prompt_cache_size:
+                    self._prompt_cache.popitem(last=False)
+        
+        return response
+    
+    def _stream_code(self, prompt: str, temperature: float, max_tokens: int = None,
+                     request_id: int = None) -> str:
+        """Stream code from the LLM, stopping as soon as the code block closes"""
+        if not self._can_stream:
+            return self.llm_engine.generate(prompt, temperature=temperature, max_tokens=max_tokens,
+                                            request_id=request_id)
+        
+        parts = []
+        try:
+            stream = self.llm_engine.generate_stream(prompt, temperature=temperature, max_tokens=max_tokens,
+                                                     request_id=request_id)
+            # Closing the stream (also on errors) closes the Ollama connection
+            with closing(stream):
+                for chunk in stream:
+                    parts.append(chunk)
+                    # Trailing explanation after the code is discarded by _clean_code anyway
+                    if '`' in chunk and self._code_block_complete(''.join(parts)):
+                        print("⏹️ Code block complete - stopping LLM stream early")
+                        break
+        except Exception as e:
+            print(f"❌ Enhanced RAG-LLM Stream Error: {e}")
+            return f"Error: {str(e)}"
+        
+        response = ''.join(parts).strip()
+        print(f"📝 Enhanced RAG-LLM Response length: {len(response)} chars")
+        return response
+    
+    def _code_block_complete(self, text: str) -> bool:
+        """Check whether a fenced code block has been opened and closed"""
+        start = text.find('```')
+        return start != -1 and text.find('```', start + 3) != -1
+    
+    def _generate_drafts(self, requests: List[Tuple], request_id: int = None) -> List[str]:
+        """Generate independent (prompt, temperature, max_tokens) drafts concurrently"""
+        if len(requests) == 1 or not self.parallel_drafts:
+            return [self._cached_generate(*r, request_id=request_id) for r in requests]
+        
+        futures = [self._pipeline_pool.submit(self._cached_generate, *r, request_id=request_id) for r in requests]
+        return [future.result() for future in futures]
+    
+    def _is_valid_draft(self, draft: str) -> bool:
+        """Cheap validation: draft must compile and define a result"""
+        code = self._clean_code(draft)
+        try:
+            compile(code, '<draft>', 'exec')
+        except SyntaxError:
+            return False
+        return 'result' in code
+    
+    def _token_budget(self, code: str) -> int:
+        """Decode budget for rewriting reference code (output is bounded by its size)"""
+        return min(2048, len(code) // 2 + 256)
+    
+    def _prompt_cache_key(self, prompt: str, temperature: float) -> str:
+        """Hash model, temperature and prompt into a cache key"""
+        model = getattr(self.llm_engine, 'model', '')
+        raw = f"{model}\x00{temperature}\x00{prompt}".encode('utf-8')
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+    
+    def _load_prompt_cache(self):
+        """Load persisted prompt cache from disk"""
+        if not self._prompt_cache_path.exists():
+            return
+        
+        try:
+            with open(self._prompt_cache_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._prompt_cache[entry['key']] = entry['response']
+            
+            while len(self._prompt_cache) > self.prompt_cache_size:
+                self._prompt_cache.popitem(last=False)
+            
+            print(f"📚 Loaded {len(self._prompt_cache)} cached LLM responses")
+        except Exception as e:
+            print(f"⚠️ Failed to load prompt cache: {e}")
+            self._prompt_cache.clear()
+    
+    def _save_prompt_cache(self):
+        """Persist prompt cache to disk"""
+        if not self._prompt_cache:
+            return
+        
+        try:
+            with open(self._prompt_cache_path, 'w', encoding='utf-8') as f:
+                for key, response in self._prompt_cache.items():
+                    f.write(json.dumps({'key': key, 'response': response}) + "\n")
+        except Exception as e:
+            print(f"⚠️ Failed to save prompt cache: {e}")
+    
+    def _cached_search(self, queries: List[str]) -> List[Tuple[str, float]]:
+        """Semantic search, reusing the results of a near-identical earlier query"""
+        query_embedding = self.rag_library.embed(queries[:1])[0]
+        cached = self._retrieval_cache.get(query_embedding)
+        if cached is not None:
+            print("⚡ Retrieval cache hit - skipping vector search")
+            return cached
+        
+        search_results = self.rag_library.semantic_search_multi(queries, top_k=5, threshold=0.0)
+        self._retrieval_cache.put(query_embedding, search_results)
+        return search_results
     
-    def _intelligent_rag_search(self, query: str, spec: Dict) -> List[Dict]:
+    def _intelligent_rag_search(self, queries: List[str], spec: Dict) -> List[Dict]:
         """Perform intelligent multi-level RAG search"""
         try:
             # Level 1: Direct search
-            search_results = self.rag_library.semantic_search(query, top_k=5, threshold=0.0)
+            search_results = self._cached_search(queries)
             
             if not search_results:
                 return []
@@ -113,55 +525,89 @@ class EnhancedRAGCADGenerator:
             # Level 2: Category-based filtering
             object_type = spec.get('object_type', '')
             
-            # Enhance results with metadata
-            enhanced_results = []
-            for ref_key, similarity in search_results:
-                reference = self.rag_library.get_reference(ref_key)
-                
-                # Boost similarity for matching categories
-                category_boost = 0.1 if self._matches_category(object_type, reference['category']) else 0
-                
-                # Adjust for complexity appropriateness
-                complexity_factor = self._calculate_complexity_factor(spec, reference['complexity'])
-                
-                adjusted_similarity = similarity + category_boost * complexity_factor
-                
-                enhanced_results.append({
-                    'name': ref_key,
-                    'similarity': adjusted_similarity,
-                    'original_similarity': similarity,
-                    'description': reference['description'],
-                    'code': reference['code'],
-                    'complexity': reference['complexity'],
-                    'category': reference['category']
-                })
+            # Fast path: an excellent top hit in the matching category needs no reranking
+            top_key, top_similarity = search_results[0]
+            if top_similarity >= 0.5:
+                reference = self.rag_library.get_reference(top_key)
+                if self._matches_category(object_type, reference['category']):
+                    factor = self._calculate_complexity_factor(spec, reference['complexity'])
+                    best = self._make_enhanced_result(top_key, reference, top_similarity + 0.1 * factor, top_similarity)
+                    self.last_similarity_score = best['similarity']
+                    self.last_complexity_used = best['complexity']
+                    print("🔍 Found excellent category match - skipping rerank")
+                    return [best]
+            references = self.rag_library.get_references_bulk([ref_key for ref_key, _ in search_results])
             
-            # Sort by adjusted similarity
-            enhanced_results.sort(key=lambda x: x['similarity'], reverse=True)
+            # Score all candidates at once: boost matching categories, scaled by
+            # complexity appropriateness
+            original = np.array([similarity for _, similarity in search_results])
+            boosts = np.array([0.1 if self._matches_category(object_type, ref['category']) else 0.0
+                               for ref in references])
+            factors = np.array([self._calculate_complexity_factor(spec, ref['complexity'])
+                                for ref in references])
+            adjusted = original + boosts * factors
             
-            # Filter by threshold
-            filtered = [r for r in enhanced_results if r['original_similarity'] >= 0.3]
+            # Filter by threshold, then keep the top_k by adjusted similarity
+            candidates = np.flatnonzero(original >= 0.3)
+            if candidates.size == 0:
+                return []
             
-            if filtered:
-                self.last_similarity_score = filtered[0]['similarity']
-                self.last_complexity_used = filtered[0]['complexity']
-                print(f"🔍 Found {len(filtered)} intelligent matches")
-                return filtered[:self.top_k]
+            k = min(self.top_k, candidates.size)
+            top = candidates[np.argpartition(-adjusted[candidates], k - 1)[:k]]
+            top = top[np.argsort(-adjusted[top], kind='stable')]
             
-            return []
+            # Only build result dicts for the survivors
+            filtered = [
+                self._make_enhanced_result(search_results[i][0], references[i], adjusted[i], original[i])
+                for i in top
+            ]
+            
+            self.last_similarity_score = filtered[0]['similarity']
+            self.last_complexity_used = filtered[0]['complexity']
+            print(f"🔍 Found {candidates.size} intelligent matches")
+            return filtered
             
         except Exception as e:
             print(f"❌ Intelligent search failed: {e}")
             return []
     
-    def _adapt_reference_code(self, reference: Dict, spec: Dict) -> str:
+    def _make_enhanced_result(self, name: str, reference: Dict, similarity: float, original_similarity: float) -> Dict:
+        """Build an enhanced search result entry"""
+        return {
+            'name': name,
+            'similarity': float(similarity),
+            'original_similarity': float(original_similarity),
+            'description': reference['description'],
+            'code': reference['code'],
+            'complexity': reference['complexity'],
+            'category': reference['category']
+        }
+    
+    def _adapt_reference_code(self, reference: Dict, spec: Dict, spec_json: str, request_id: int = None) -> str:
         """Intelligently adapt reference code to match specifications"""
         code = reference['code'] if isinstance(reference, dict) else reference
         
-        # Extract current parameters from reference
-        current_params = self._extract_parameters_from_code(code)
+        # Pure dimension changes need no LLM: every spec value maps onto a reference parameter
+        # and no requested features ride along in requirements/notes
+        if (isinstance(reference, dict) and not self._features_to_remove(spec)
+                and not spec.get('requirements') and not spec.get('notes')):
+            current_params = self._extract_parameters_from_code(code)
+            missing = {k for k in spec if not k.startswith('_') and k not in _DESCRIPTIVE_SPEC_KEYS} - set(current_params)
+            if not missing:
+                print("⚡ All spec values map to reference parameters - skipping LLM adaptation")
+                return self._use_reference_with_parameters(reference, spec)
+        
+        prompt = self._build_adaptation_prompt(code, spec, spec_json)
+        
+        self.last_generation_mode = "intelligent_adaptation"
+        # Greedy decoding: adaptation is a deterministic rewrite of the reference
+        adapted_code = self._cached_generate(prompt, temperature=0.0,
+                                             max_tokens=self._token_budget(code), request_id=request_id)
         
-        # Determine what features to remove
+        return self._ensure_features_removed(adapted_code, code, spec)
+    
+    def _features_to_remove(self, spec: Dict) -> List[str]:
+        """Optional features the spec explicitly turns off"""
         features_to_remove = []
         if spec.get('has_handle') == False:
             features_to_remove.append('handle')
@@ -169,38 +615,24 @@ class EnhancedRAGCADGenerator:
             features_to_remove.append('lid')
         if spec.get('has_holes') == False:
             features_to_remove.append('holes')
+        return features_to_remove
+    
+    def _build_adaptation_prompt(self, code: str, spec: Dict, spec_json: str) -> str:
+        """Build prompt for adapting reference code to a spec"""
+        features_to_remove = self._features_to_remove(spec)
         
         # Build adaptation prompt with clear instructions
         adaptation_instructions = ""
         if features_to_remove:
-            adaptation_instructions = f"\nIMPORTANT: Remove these features completely from the code:\n"
-            for feature in features_to_remove:
-                adaptation_instructions += f"- Remove all {feature}-related code sections\n"
+            adaptation_instructions = "\nIMPORTANT: Remove these features completely from the code:\n" + "".join(
+                f"- Remove all {feature}-related code sections\n" for feature in features_to_remove
+            )
         
-        prompt = f"""Adapt this CadQuery code to match the new specifications.
-
-REFERENCE CODE:
-```python
-{code}
-```
-
-NEW SPECIFICATIONS:
-{json.dumps(spec, indent=2)}
-{adaptation_instructions}
-ADAPTATION RULES:
-1. Keep the overall structure and approach
-2. Update all dimension variables to match specifications
-3. COMPLETELY REMOVE code sections for features marked as False (has_handle=False means NO handle code)
-4. For has_handle=False: Remove handle creation, handle path, and handle union
-5. Add features if spec has new requirements
-6. Maintain manufacturing constraints
-7. Keep error handling but adapt it too
-
-Generate ONLY the adapted CadQuery code (no handle if has_handle=False):"""
+        return ''.join((_ADAPT_HEAD, code, _ADAPT_MID, spec_json, "\n",
+                        adaptation_instructions, _ADAPT_TAIL))
     
-        self.last_generation_mode = "intelligent_adaptation"
-        adapted_code = self.llm_engine.generate(prompt, temperature=0.2)
-        
+    def _ensure_features_removed(self, adapted_code: str, code: str, spec: Dict) -> str:
+        """Fall back to direct removal when the LLM kept removed features"""
         # Double-check: if still has handle code when it shouldn't, try simpler approach
         if spec.get('has_handle') == False and 'handle' in adapted_code.lower():
             print("⚠️ LLM didn't remove handle, using direct removal")
@@ -210,15 +642,13 @@ Generate ONLY the adapted CadQuery code (no handle if has_handle=False):"""
     
     def _remove_handle_code_directly(self, code: str, spec: Dict) -> str:
         """Directly remove handle code from reference"""
-        lines = code.split('\n')
         cleaned_lines = []
         skip_section = False
         skip_depth = 0
         
-        for line in lines:
+        for line in code.split('\n'):
             # Skip handle-related variable definitions
-            if any(h in line.lower() for h in ['handle_width', 'handle_height', 'handle_thickness', 
-                                            'handle_arc', 'handle_offset', 'handle_path']):
+            if _HANDLE_PARAM_RE.search(line):
                 continue
             
             # Skip handle creation sections
@@ -235,26 +665,21 @@ Generate ONLY the adapted CadQuery code (no handle if has_handle=False):"""
                 else:
                     skip_section = False
             
-            # Replace union with handle to just return the body
-            if 'union(handle)' in line:
-                line = line.replace('.union(handle)', '')
-            
-            # Update result assignment
-            if 'result = ' in line and 'union(handle)' in line:
-                line = '    result = mug_body'
-            
-            # Update parameter values from spec
-            for param, value in spec.items():
-                if param.startswith('_') or param == 'has_handle':
-                    continue
-                # Simple parameter replacement
-                pattern = rf'{param}\s*=\s*\d+(?:\.\d+)?'
-                if re.search(pattern, line):
-                    line = re.sub(pattern, f'{param} = {value}', line)
-            
             cleaned_lines.append(line)
         
-        return '\n'.join(cleaned_lines)
+        # Replace union with handle to just return the body
+        cleaned = '\n'.join(cleaned_lines).replace('.union(handle)', '')
+        
+        # Update parameter values from spec in a single pass
+        params = {k: v for k, v in spec.items() if not k.startswith('_') and k != 'has_handle'}
+        if not params:
+            return cleaned
+        
+        # Unanchored like the per-parameter substitution it replaces: 'radius' also
+        # updates 'mug_radius = 40'; longer names go first so an exact key wins
+        names = sorted(params, key=len, reverse=True)
+        param_re = re.compile(r'(' + '|'.join(map(re.escape, names)) + r')\s*=\s*\d+(?:\.\d+)?')
+        return param_re.sub(lambda m: f"{m[1]} = {params[m[1]]}", cleaned)
     
     def _use_reference_with_parameters(self, reference: Dict, spec: Dict) -> str:
         """Use reference code with simple parameter substitution"""
@@ -265,114 +690,109 @@ Generate ONLY the adapted CadQuery code (no handle if has_handle=False):"""
             if param.startswith('_'):  # Skip metadata
                 continue
             
-            # Find and replace parameter assignments
+            # Find and replace assignments to exactly this name ('height' leaves 'handle_height' alone)
+            name = re.escape(param)
             patterns = [
-                rf'{param}\s*=\s*\d+(?:\.\d+)?',
-                rf'{param}\s*=\s*["\'][^"\']+["\']',
+                rf'^([ \t]*){name}\s*=\s*\d+(?:\.\d+)?',
+                rf'^([ \t]*){name}\s*=\s*["\'][^"\']+["\']',
             ]
             
             for pattern in patterns:
-                if re.search(pattern, code):
-                    code = re.sub(pattern, f'{param} = {value}', code)
+                code = re.sub(pattern, lambda m: f'{m[1]}{param} = {value}', code, flags=re.M)
         
         self.last_generation_mode = "parameter_substitution"
         return code
     
-    def _combine_reference_patterns(self, references: List[Dict], spec: Dict) -> str:
+    def _combine_reference_patterns(self, references: List[Dict], spec: Dict, spec_json: str,
+                                    request_id: int = None) -> str:
         """Combine patterns from multiple references"""
         # Build combination prompt
+        # Canonical (name) order: the same retrieved pair always yields the same prompt prefix
         examples = "\n\n".join([
             f"REFERENCE {i+1} ({ref['name']}, {ref['similarity']:.3f}):\n```python\n{ref['code'][:500]}...\n```"
-            for i, ref in enumerate(references[:2])
+            for i, ref in enumerate(sorted(references[:2], key=lambda r: r['name']))
         ])
         
-        prompt = f"""Combine the best patterns from these references to create the target object.
-
-{examples}
-
-TARGET SPECIFICATION:
-{json.dumps(spec, indent=2)}
-
-COMBINATION STRATEGY:
-- Take the base structure from the most similar reference
-- Add features from other references as needed
-- Ensure all parts work together
-- Match exact specifications
-
-Generate ONLY the combined CadQuery code:"""
+        prompt = ''.join((_COMBINE_HEAD, examples, _COMBINE_MID, spec_json, _COMBINE_TAIL))
         
         self.last_generation_mode = "pattern_combination"
-        return self.llm_engine.generate(prompt, temperature=0.3)
+        best_code = references[0]['code']
+        max_tokens = self._token_budget(best_code)
+        if not self.parallel_drafts:
+            return self._cached_generate(prompt, temperature=0.3, max_tokens=max_tokens, request_id=request_id)
+        
+        # Draft a direct adaptation of the best match alongside the combination
+        combined, adapted = self._generate_drafts([
+            (prompt, 0.3, max_tokens),
+            (self._build_adaptation_prompt(best_code, spec, spec_json), 0.0, max_tokens),
+        ], request_id)
+        
+        if not self._is_valid_draft(combined) and self._is_valid_draft(adapted):
+            print("🔀 Combination draft invalid - using parallel adaptation draft")
+            self.last_generation_mode = "intelligent_adaptation"
+            return self._ensure_features_removed(adapted, best_code, spec)
+        
+        return combined
     
-    def _adapt_category_patterns(self, references: List[Dict], spec: Dict) -> str:
+    def _adapt_category_patterns(self, references: List[Dict], spec: Dict, spec_json: str,
+                                 request_id: int = None) -> str:
         """Adapt patterns from same category"""
         category_refs = [r for r in references if r['category'] == references[0]['category']]
         
-        prompt = f"""Use these {references[0]['category']} category patterns to create a new object.
-
-CATEGORY EXAMPLES:
-{category_refs[0]['name']}: {category_refs[0]['description']}
-
-TARGET: Create a {spec.get('object_type', 'object')} with these specifications:
-{json.dumps(spec, indent=2)}
-
-Apply the category's design patterns and best practices.
-
-Generate ONLY the CadQuery code:"""
+        prompt = _CATEGORY_HEAD + _CATEGORY_PROMPT.format(
+            category=references[0]['category'],
+            name=category_refs[0]['name'],
+            description=category_refs[0]['description'],
+            object_type=spec.get('object_type', 'object')
+        ) + spec_json + _CATEGORY_TAIL
         
         self.last_generation_mode = "category_adaptation"
-        return self.llm_engine.generate(prompt, temperature=0.3)
+        return self._cached_generate(prompt, temperature=0.3, request_id=request_id)
     
-    def _hybrid_generation(self, references: List[Dict], spec: Dict) -> str:
+    def _hybrid_generation(self, references: List[Dict], spec_json: str, request_id: int = None) -> str:
         """Hybrid approach combining RAG insights with reasoning"""
         insights = self._extract_design_insights(references)
         
-        prompt = f"""Generate CadQuery code using these design insights and engineering principles.
-
-DESIGN INSIGHTS FROM SIMILAR OBJECTS:
-{insights}
-
-TARGET SPECIFICATION:
-{json.dumps(spec, indent=2)}
-
-Apply both the insights and your engineering knowledge to create the best solution.
-
-Generate ONLY the CadQuery code:"""
+        prompt = ''.join((_HYBRID_HEAD, insights, _HYBRID_MID, spec_json, _HYBRID_TAIL))
         
         self.last_generation_mode = "hybrid_generation"
-        return self.llm_engine.generate(prompt, temperature=0.3)
+        return self._cached_generate(prompt, temperature=0.3, request_id=request_id)
     
     def _extract_design_insights(self, references: List[Dict]) -> str:
         """Extract design patterns and insights from references"""
         insights = []
         
         for ref in references[:3]:
-            # Extract key patterns from code
-            code = ref['code']
-            
             # Look for common patterns
-            if 'fillet' in code:
+            flags = self._insight_flags(ref['code'])
+            
+            if flags & _FILLET_INSIGHT:
                 insights.append(f"- Use filleting for smooth edges (from {ref['name']})")
-            if 'shell' in code:
+            if flags & _SHELL_INSIGHT:
                 insights.append(f"- Use shell() for hollow objects (from {ref['name']})")
-            if 'union' in code or 'cut' in code:
+            if flags & _BOOLEAN_INSIGHT:
                 insights.append(f"- Use boolean operations for complex shapes (from {ref['name']})")
             
         return '\n'.join(insights) if insights else "- Use standard CadQuery best practices"
     
+    def _insight_flags(self, code: str) -> int:
+        """Get (memoized) design insight flags for reference code"""
+        flags = self._reference_insights.get(code)
+        if flags is None:
+            flags = 0
+            if 'fillet' in code:
+                flags |= _FILLET_INSIGHT
+            if 'shell' in code:
+                flags |= _SHELL_INSIGHT
+            if 'union' in code or 'cut' in code:
+                flags |= _BOOLEAN_INSIGHT
+            self._reference_insights[code] = flags
+        return flags
+    
     def _matches_category(self, object_type: str, category: str) -> bool:
         """Check if object type matches category"""
-        category_mappings = {
-            'primitive': ['box', 'cylinder', 'sphere', 'cone'],
-            'functional': ['stand', 'holder', 'bracket', 'container', 'hook'],
-            'mathematical': ['gear', 'spring', 'thread', 'helix'],
-            'manufacturing': ['joint', 'hinge', 'snap', 'assembly']
-        }
-        
-        for cat, types in category_mappings.items():
-            if cat == category:
-                return any(t in object_type.lower() for t in types)
-        return False
+        object_lower = object_type.lower()
+        return any(t in object_lower for t in _CATEGORY_TYPES.get(category, ()))
     
     def _calculate_complexity_factor(self, spec: Dict, complexity: str) -> float:
         """Calculate complexity appropriateness factor"""
@@ -388,30 +808,17 @@ Generate ONLY the CadQuery code:"""
             return 1.0 if complexity == 'advanced' else 0.8
     
     def _extract_parameters_from_code(self, code: str) -> Dict:
-        """Extract parameter names and defaults from reference code"""
+        """Extract parameter names and defaults from reference code (memoized)"""
+        cached = self._reference_params.get(code)
+        if cached is not None:
+            return dict(cached)
+        
         parameters = {}
         
-        # Pattern to find variable assignments
-        patterns = [
-            r'(\w+)\s*=\s*(\d+(?:\.\d+)?)\s*(?:#.*)?',  # number assignments
-            r'(\w+)\s*=\s*["\']([^"\']+)["\']',  # string assignments
-        ]
-        
-        # Common parameter keywords to look for
-        param_keywords = [
-            'width', 'height', 'depth', 'length', 'diameter', 'radius',
-            'thickness', 'wall_thickness', 'teeth', 'module', 'pitch',
-            'coils', 'wire_diameter', 'angle', 'offset', 'clearance',
-            'bore', 'thread', 'size', 'count', 'spacing',
-            'handle_width', 'handle_height', 'handle_thickness',
-            'mug_radius', 'mug_height'  # Add specific mug parameters
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, code)
-            for match in matches:
+        for pattern in (_NUM_ASSIGN_RE, _STR_ASSIGN_RE):
+            for match in pattern.findall(code):
                 param_name = match[0].lower()
-                if any(keyword in param_name for keyword in param_keywords):
+                if _PARAM_KEYWORD_RE.search(param_name):
                     try:
                         parameters[param_name] = float(match[1])
                     except:
@@ -421,31 +828,41 @@ Generate ONLY the CadQuery code:"""
         if 'handle' in code.lower() and 'handle =' in code.lower():
             parameters['has_handle'] = 'optional'
         
-        return parameters
+        self._reference_params[code] = parameters
+        return dict(parameters)
     
-    def _build_enhanced_semantic_query(self, spec: Dict) -> str:
-        """Build enhanced semantic search query with intelligent context"""
+    def _build_enhanced_semantic_query(self, spec: Dict) -> List[str]:
+        """Build enhanced semantic search queries with intelligent context
+        
+        Returns the full combined query followed by focused sub-queries
+        (object type, requirements, notes) for batched search.
+        """
         query_parts = []
+        sub_queries = []
         
         # Add object type with intelligent expansion
         if 'object_type' in spec:
             obj_type = spec['object_type']
-            query_parts.append(obj_type.replace('_', ' '))
+            object_parts = [obj_type.replace('_', ' ')]
             
             # Add intelligent context based on object type
             if 'gear' in obj_type:
-                query_parts.extend(['mechanical', 'transmission', 'involute', 'teeth'])
+                object_parts.extend(['mechanical', 'transmission', 'involute', 'teeth'])
             elif 'spring' in obj_type:
-                query_parts.extend(['helical', 'compression', 'coil', 'mechanical'])
+                object_parts.extend(['helical', 'compression', 'coil', 'mechanical'])
             elif 'bracket' in obj_type or 'mount' in obj_type:
-                query_parts.extend(['structural', 'mounting', 'load bearing'])
+                object_parts.extend(['structural', 'mounting', 'load bearing'])
             elif 'container' in obj_type or 'box' in obj_type:
-                query_parts.extend(['storage', 'hollow', 'wall thickness'])
+                object_parts.extend(['storage', 'hollow', 'wall thickness'])
+            
+            query_parts.extend(object_parts)
+            sub_queries.append(' '.join(object_parts))
         
         # Add intelligent requirements analysis
         if 'requirements' in spec and spec['requirements']:
             requirements_text = ' '.join(spec['requirements']).replace('_', ' ')
             query_parts.append(requirements_text)
+            sub_queries.append(requirements_text)
         
         # Add technical specifications
         technical_params = []
@@ -459,25 +876,20 @@ Generate ONLY the CadQuery code:"""
         # Add contextual information
         if 'notes' in spec:
             query_parts.append(spec['notes'])
+            sub_queries.append(spec['notes'])
         
         query = ' '.join(query_parts)
         print(f"🔍 Enhanced semantic query: '{query}'")
-        return query
+        
+        queries = [query]
+        for sub_query in sub_queries:
+            if sub_query and sub_query not in queries:
+                queries.append(sub_query)
+        return queries
     
-    def _build_intelligent_reasoning_prompt(self, spec: Dict) -> str:
+    def _build_intelligent_reasoning_prompt(self, spec_json: str) -> str:
         """Build prompt for pure intelligent reasoning"""
-        return f"""Generate CadQuery code for: {json.dumps(spec, indent=2)}
-
-Requirements:
-- Import cadquery as cq
-- Create 'result' variable  
-- Include try/except fallback
-- Use appropriate CadQuery methods for this object type
-- Apply engineering principles and best practices
-- Consider 3D printing constraints
-- ONLY output executable Python code
-
-Code only:"""
+        return _REASONING_HEAD + spec_json + _REASONING_TAIL
     
     def _execute_code(self, code: str) -> cq.Workplane:
         """Execute CadQuery code safely with enhanced debugging"""
@@ -485,16 +897,15 @@ Code only:"""
         code = self._clean_code(code)
         
         # Debug: Print code with line numbers for troubleshooting
-        print("🔍 Generated code with line numbers:")
-        for i, line in enumerate(code.split('\n'), 1):
-            print(f"{i:2d}: {line}")
+        if self.debug:
+            self._print_numbered_code(code)
         
         # Safe execution environment
-        safe_globals = {'cq': cq, 'cadquery': cq, 'math': __import__('math')}
+        safe_globals = _SAFE_GLOBALS.copy()
         safe_locals = {}
         
         try:
-            exec(code, safe_globals, safe_locals)
+            exec(self._compile_code(code), safe_globals, safe_locals)
             
             if 'result' in safe_locals:
                 result = safe_locals['result']
@@ -507,16 +918,35 @@ Code only:"""
             
         except Exception as e:
             print(f"❌ Code execution failed: {e}")
+            if not self.debug:
+                self._print_numbered_code(code)
             raise Exception(f"Code execution failed: {e}")
     
+    def _print_numbered_code(self, code: str):
+        """Print code with line numbers in a single write"""
+        numbered = '\n'.join(f"{i:2d}: {line}" for i, line in enumerate(code.split('\n'), 1))
+        print(f"🔍 Generated code with line numbers:\n{numbered}")
+    
+    def _compile_code(self, code: str):
+        """Compile code, reusing the code object for identical source"""
+        key = hashlib.blake2b(code.encode('utf-8'), digest_size=12).digest()
+        
+        compiled = self._code_cache.get(key)
+        if compiled is None:
+            compiled = compile(code, '<rag>', 'exec')
+            self._code_cache[key] = compiled
+            if len(self._code_cache) > self.prompt_cache_size:
+                self._code_cache.popitem(last=False)
+        else:
+            self._code_cache.move_to_end(key)
+        
+        return compiled
+    
     def _clean_code(self, code: str) -> str:
         """Clean and extract ONLY Python code"""
         
-        # Remove markdown code blocks - more aggressive patterns
-        code = re.sub(r'```python\s*\n?', '', code, flags=re.IGNORECASE)
-        code = re.sub(r'```\s*\n?', '', code)
-        code = re.sub(r'```python', '', code, flags=re.IGNORECASE)  
-        code = re.sub(r'```', '', code)
+        # Remove markdown code blocks
+        code = _MD_FENCE_RE.sub('', code)
         
         # Remove any remaining backticks
         code = code.replace('`', '')
@@ -526,19 +956,12 @@ Code only:"""
             start_idx = code.find('import cadquery')
             code = code[start_idx:]
         
-        # Remove any trailing markdown or explanatory text
-        lines = code.split('\n')
-        clean_lines = []
+        # Remove any trailing markdown or explanatory text from its line onwards
+        match = _EXPLAIN_RE.search(code)
+        if match:
+            code = code[:code.rfind('\n', 0, match.start()) + 1]
         
-        for line in lines:
-            # Stop at explanatory text
-            if any(phrase in line.lower() for phrase in [
-                'this code', 'note that', 'the above', 'explanation:', 'output:'
-            ]):
-                break
-            clean_lines.append(line)
-        
-        return '\n'.join(clean_lines).strip()
+        return code.strip()
     
     def visualize(self, model: cq.Workplane):
         """Visualize model using CadQuery viewer"""
@@ -572,33 +995,53 @@ Code only:"""
     def add_reference_example(self, name: str, description: str, code: str, complexity: str = "medium", category: str = "functional"):
         """Add new reference example with enhanced metadata"""
         self.rag_library.add_reference(name, description, code, complexity, category)
+        self._retrieval_cache.clear()
+        self._library_stats = None
         print(f"✅ Added enhanced reference example: {name} ({complexity}, {category})")
     
+    def iter_reference_texts(self):
+        """Yield the embedding text of every reference example"""
+        yield from self.rag_library.reference_texts()
+    
     def get_enhanced_rag_stats(self) -> Dict:
         """Get Enhanced RAG system statistics"""
+        if self._library_stats is None:
+            self._library_stats = self._compute_library_stats()
+        
+        stats = dict(self._library_stats)
+        stats.update({
+            'top_k': self.top_k,
+            'similarity_threshold': self.similarity_threshold,
+            'last_generation_mode': self.last_generation_mode,
+            'last_similarity_score': self.last_similarity_score,
+            'last_complexity_used': self.last_complexity_used,
+            'rag_enabled': self.rag_enabled
+        })
+        return stats
+    
+    def _compute_library_stats(self) -> Dict:
+        """Walk the reference library for counts and distributions"""
+        references = self.rag_library.get_all_references()
         complexity_counts = {}
         category_counts = {}
         
-        for ref in self.rag_library.get_all_references().values():
+        for ref in references.values():
             complexity = ref.get('complexity', 'unknown')
             category = ref.get('category', 'unknown')
             complexity_counts[complexity] = complexity_counts.get(complexity, 0) + 1
             category_counts[category] = category_counts.get(category, 0) + 1
         
         return {
-            'total_references': len(self.rag_library.get_all_references()),
+            'total_references': len(references),
             'embedding_model': self.rag_library.embedding_model_name,
-            'top_k': self.top_k,
-            'similarity_threshold': self.similarity_threshold,
             'cache_dir': str(self.rag_library.cache_dir),
-            'last_generation_mode': self.last_generation_mode,
-            'last_similarity_score': self.last_similarity_score,
-            'last_complexity_used': self.last_complexity_used,
+            'embeddings_cached': self.rag_library.embeddings_from_cache,
             'complexity_distribution': complexity_counts,
-            'category_distribution': category_counts,
-            'rag_enabled': self.rag_enabled
+            'category_distribution': category_counts
         }
     
     def rebuild_embeddings(self):
         """Force rebuild enhanced embeddings"""
         self.rag_library.rebuild_embeddings()
+        self._retrieval_cache.clear()
+        self._library_stats = None
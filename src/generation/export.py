@@ -1,75 +1,14 @@
 # src/generation/export.py
 """Enhanced Model Exporter for STL, STEP, and Code Export"""
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional
 import cadquery as cq
 
-class ModelExporter:
-    def __init__(self, export_directory: str = "./exports"):
-        self.export_directory = Path(export_directory)
-        self.export_directory.mkdir(exist_ok=True)
-        print(f"📁 Export directory: {self.export_directory}")
-    
-    def export_model(self, model: cq.Workplane, model_spec: Dict, cadquery_code: str) -> Dict:
-        """Export model to multiple formats with enhanced metadata"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        object_type = model_spec.get('object_type', 'model')
-        base_filename = f"{object_type}_{timestamp}"
-        
-        files = {}
-        total_size = 0
-        
-        try:
-            # Export STL for 3D printing
-            stl_path = self.export_directory / f"{base_filename}.stl"
-            cq.exporters.export(model, str(stl_path))
-            files['STL'] = str(stl_path)
-            total_size += stl_path.stat().st_size
-            
-            # Export STEP for CAD interoperability
-            step_path = self.export_directory / f"{base_filename}.step"
-            cq.exporters.export(model, str(step_path))
-            files['STEP'] = str(step_path)
-            total_size += step_path.stat().st_size
-            
-            # Export CadQuery code with enhanced metadata
-            code_path = self.export_directory / f"{base_filename}.py"
-            enhanced_code = self._create_enhanced_code_export(cadquery_code, model_spec)
-            with open(code_path, 'w') as f:
-                f.write(enhanced_code)
-            files['Python'] = str(code_path)
-            total_size += code_path.stat().st_size
-            
-            # Export metadata JSON
-            metadata_path = self.export_directory / f"{base_filename}_metadata.json"
-            metadata = self._create_metadata(model_spec, files)
-            import json
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
-            files['Metadata'] = str(metadata_path)
-            total_size += metadata_path.stat().st_size
-            
-            print(f"✅ Enhanced export complete: {len(files)} files, {total_size/1024/1024:.2f} MB")
-            
-            return {
-                'files': files,
-                'file_size_mb': total_size / 1024 / 1024,
-                'base_filename': base_filename,
-                'export_directory': str(self.export_directory)
-            }
-            
-        except Exception as e:
-            print(f"❌ Enhanced export failed: {e}")
-            raise Exception(f"Export failed: {e}")
-    
-    def _create_enhanced_code_export(self, code: str, spec: Dict) -> str:
-        """Create enhanced code export with metadata and documentation"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        object_type = spec.get('object_type', 'unknown')
-        
-        enhanced_code = f'''"""
+# Header and footer wrapped around exported CadQuery code (filled with format_map)
+_CODE_EXPORT_TEMPLATE = '''"""
 Enhanced RAG + Intelligent Reasoning Generated CadQuery Model
 =============================================================
 
@@ -78,7 +17,7 @@ Object Type: {object_type}
 System: Enhanced RAG + Intelligent AI Manufacturing
 
 Specification:
-{self._format_spec_as_comment(spec)}
+{spec_comment}
 
 Instructions:
 1. Ensure CadQuery is installed: pip install cadquery
@@ -114,7 +53,101 @@ import cadquery as cq
 
 # Enhanced RAG Generation Complete
 '''
-        return enhanced_code
+
+class ModelExporter:
+    def __init__(self, export_directory: str = "./exports"):
+        self.export_directory = Path(export_directory)
+        self.export_directory.mkdir(exist_ok=True)
+        print(f"📁 Export directory: {self.export_directory}")
+    
+    def export_model(self, model: cq.Workplane, model_spec: Dict, cadquery_code: str,
+                     on_file_ready: Optional[Callable[[str, str], None]] = None) -> Dict:
+        """Export model to multiple formats with enhanced metadata
+        
+        The code file is written on a helper thread while the geometry is
+        tessellated; on_file_ready(format, path) fires as each file lands.
+        """
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        object_type = model_spec.get('object_type', 'model')
+        base_filename = f"{object_type}_{timestamp}"
+        
+        files = {}
+        total_size = 0
+        
+        def file_ready(fmt: str, path: Path):
+            nonlocal total_size
+            files[fmt] = str(path)
+            total_size += path.stat().st_size
+            if on_file_ready:
+                on_file_ready(fmt, str(path))
+        
+        try:
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="export-code") as pool:
+                # Export CadQuery code with enhanced metadata; independent of the geometry
+                code_path = self.export_directory / f"{base_filename}.py"
+                code_future = pool.submit(self._write_code, cadquery_code, model_spec, code_path)
+                
+                # Export STL for 3D printing (geometry stays on this thread:
+                # OCC shapes are not safe to mesh and serialize concurrently)
+                stl_path = self.export_directory / f"{base_filename}.stl"
+                self._export_stl(model, stl_path)
+                file_ready('STL', stl_path)
+                
+                # Export STEP for CAD interoperability
+                step_path = self.export_directory / f"{base_filename}.step"
+                self._export_step(model, step_path)
+                file_ready('STEP', step_path)
+                
+                code_future.result()
+                file_ready('Python', code_path)
+            
+            # Export metadata JSON
+            metadata_path = self.export_directory / f"{base_filename}_metadata.json"
+            metadata = self._create_metadata(model_spec, files)
+            import json
+            with open(metadata_path, 'w') as f:
+                json.dump(metadata, f, indent=2)
+            files['Metadata'] = str(metadata_path)
+            total_size += metadata_path.stat().st_size
+            
+            print(f"✅ Enhanced export complete: {len(files)} files, {total_size/1024/1024:.2f} MB")
+            
+            return {
+                'files': files,
+                'file_size_mb': total_size / 1024 / 1024,
+                'base_filename': base_filename,
+                'export_directory': str(self.export_directory)
+            }
+            
+        except Exception as e:
+            print(f"❌ Enhanced export failed: {e}")
+            raise Exception(f"Export failed: {e}")
+    
+    def _export_stl(self, model: cq.Workplane, path: Path):
+        """Write an STL mesh (CadQuery meshes with OCCT's parallel mesher)"""
+        cq.exporters.export(model, str(path), exportType=cq.exporters.ExportTypes.STL)
+    
+    def _export_step(self, model: cq.Workplane, path: Path):
+        """Write a STEP file"""
+        cq.exporters.export(model, str(path), exportType=cq.exporters.ExportTypes.STEP)
+    
+    def _write_code(self, code: str, spec: Dict, code_path: Path):
+        """Write the enhanced code export file"""
+        enhanced_code = self._create_enhanced_code_export(code, spec)
+        with open(code_path, 'w') as f:
+            f.write(enhanced_code)
+    
+    def _create_enhanced_code_export(self, code: str, spec: Dict) -> str:
+        """Create enhanced code export with metadata and documentation"""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        object_type = spec.get('object_type', 'unknown')
+        
+        return _CODE_EXPORT_TEMPLATE.format_map({
+            'timestamp': timestamp,
+            'object_type': object_type,
+            'spec_comment': self._format_spec_as_comment(spec),
+            'code': code
+        })
     
     def _format_spec_as_comment(self, spec: Dict) -> str:
         """Format specification as readable comment"""
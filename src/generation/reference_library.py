@@ -2,12 +2,29 @@
 """Enhanced Hierarchical RAG Reference Library with Intelligent Patterns"""
 #TO ADD - ALL EXCEPT should be a LOGO GENERATION FAILED
 import numpy as np
+import hashlib
 import pickle
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Tuple
 from sentence_transformers import SentenceTransformer
 import faiss
+from ..cache.embedder import CachedEmbedder
+
+@lru_cache(maxsize=1)
+def get_embedding_model(name: str) -> SentenceTransformer:
+    """Load the embedding model once per process (safetensors weights are memory-mapped)
+    
+    Runs on CUDA in FP16 when a GPU is available; EMBEDDING_DEVICE overrides.
+    """
+    import torch
+    device = os.getenv('EMBEDDING_DEVICE') or ('cuda' if torch.cuda.is_available() else 'cpu')
+    print(f"🧠 Loading embedding model: {name} ({device})")
+    model = SentenceTransformer(name, device=device)
+    if device.startswith('cuda'):
+        model.half()
+    return model
 
 class EnhancedRAGReferenceLibrary:
     """Enhanced RAG library with hierarchical complexity and intelligent patterns"""
@@ -17,9 +34,12 @@ class EnhancedRAGReferenceLibrary:
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
         
-        # Initialize embedding model
-        print(f"🧠 Loading embedding model: {embedding_model}")
-        self.embedding_model = SentenceTransformer(embedding_model)
+        # Initialize embedding model (shared by every library in the process)
+        self.embedding_model = get_embedding_model(embedding_model)
+        
+        # Content-hash cache so repeated texts skip the encoder
+        self.embedder = CachedEmbedder(self._encode,
+                                       cache_capacity=int(os.getenv('EMBEDDING_CACHE_SIZE', '2000')))
         
         # Enhanced hierarchical reference library
         self.library = self._build_enhanced_library()
@@ -28,6 +48,7 @@ class EnhancedRAGReferenceLibrary:
         self.embeddings = None
         self.faiss_index = None
         self.reference_keys = None
+        self.embeddings_from_cache = False
         
         # Initialize embeddings
         self._initialize_embeddings()
@@ -892,39 +913,47 @@ except Exception:
         }
     
     def _initialize_embeddings(self):
-        """Initialize or load embeddings for semantic search"""
-        embeddings_path = self.cache_dir / "enhanced_embeddings.pkl"
+        """Initialize or load embeddings for semantic search
+        
+        Cached embeddings are reused only while the library content hash
+        matches, so editing a reference triggers a re-embed.
+        """
+        embeddings_path = self.cache_dir / "enhanced_embeddings.npy"
         index_path = self.cache_dir / "enhanced_faiss_index.bin"
+        hash_path = self.cache_dir / "enhanced_library.sha256"
         
-        if embeddings_path.exists() and index_path.exists():
+        cached_hash = hash_path.read_text().strip() if hash_path.exists() else None
+        if embeddings_path.exists() and index_path.exists() and cached_hash == self._library_hash():
             self._load_embeddings()
         else:
+            if cached_hash:
+                print("🔄 Reference library changed since embeddings were cached")
             self._create_embeddings()
     
+    def _library_hash(self) -> str:
+        """Hash of everything the cached embeddings and index depend on"""
+        digest = hashlib.sha256()
+        settings = [self.embedding_model_name] + [os.getenv(name, '') for name in
+                    ('HNSW_MIN_REFERENCES', 'HNSW_M', 'HNSW_EF_CONSTRUCTION', 'EMBEDDING_QUANT')]
+        for text in settings + sorted(self.reference_texts()):
+            digest.update(text.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
     def _create_embeddings(self):
         """Create embeddings for all reference examples"""
         print("🔄 Creating embeddings for enhanced reference library...")
         
         # Prepare texts for embedding with enhanced context
-        texts = []
-        keys = []
-        
-        for key, example in self.library.items():
-            # Enhanced text includes complexity and category
-            text = f"{key.replace('_', ' ')} {example['description']} {example['complexity']} {example['category']}"
-            texts.append(text)
-            keys.append(key)
+        keys = list(self.library)
+        texts = self.reference_texts()
         
-        # Create embeddings
-        embeddings = self.embedding_model.encode(texts)
+        # Create embeddings (normalized for cosine similarity)
+        embeddings = self.embedder.encode(texts)
+        self.embeddings_from_cache = False
         
         # Create FAISS index
-        dimension = embeddings.shape[1]
-        index = faiss.IndexFlatIP(dimension)  # Inner product (cosine similarity)
-        
-        # Normalize vectors for cosine similarity
-        faiss.normalize_L2(embeddings)
-        index.add(embeddings.astype('float32'))
+        index = self._build_index(embeddings)
         
         # Store
         self.embeddings = embeddings
@@ -936,15 +965,46 @@ except Exception:
         
         print(f"✅ Created enhanced embeddings for {len(texts)} references")
     
+    def _build_index(self, embeddings: np.ndarray):
+        """Build a FAISS inner-product index (cosine similarity on normalized vectors)
+        
+        Small libraries use brute-force search (float32, or int8 scalar-quantized
+        with EMBEDDING_QUANT=int8); once the library reaches HNSW_MIN_REFERENCES
+        an HNSW graph index is used instead.
+        """
+        dimension = embeddings.shape[1]
+        hnsw_min_references = int(os.getenv('HNSW_MIN_REFERENCES', '256'))
+        quantization = os.getenv('EMBEDDING_QUANT', 'fp32').lower()
+        
+        if len(embeddings) >= hnsw_min_references:
+            index = faiss.IndexHNSWFlat(dimension, int(os.getenv('HNSW_M', '32')), faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = int(os.getenv('HNSW_EF_CONSTRUCTION', '200'))
+            self._set_ef_search(index)
+            print(f"🕸️ Building HNSW index for {len(embeddings)} references")
+        elif quantization == 'int8':
+            index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit,
+                                               faiss.METRIC_INNER_PRODUCT)
+            index.train(embeddings)
+        else:
+            index = faiss.IndexFlatIP(dimension)
+        
+        index.add(embeddings)
+        return index
+    
+    def _set_ef_search(self, index):
+        """Apply the query-time HNSW beam width (no-op for flat indexes)"""
+        if hasattr(index, 'hnsw'):
+            index.hnsw.efSearch = int(os.getenv('HNSW_EF_SEARCH', '64'))
+    
     def _save_embeddings(self):
         """Save embeddings to disk"""
-        embeddings_path = self.cache_dir / "enhanced_embeddings.pkl"
+        embeddings_path = self.cache_dir / "enhanced_embeddings.npy"
         index_path = self.cache_dir / "enhanced_faiss_index.bin"
         keys_path = self.cache_dir / "enhanced_keys.pkl"
+        hash_path = self.cache_dir / "enhanced_library.sha256"
         
         # Save embeddings and keys
-        with open(embeddings_path, 'wb') as f:
-            pickle.dump(self.embeddings, f)
+        np.save(embeddings_path, self.embeddings)
         
         with open(keys_path, 'wb') as f:
             pickle.dump(self.reference_keys, f)
@@ -952,51 +1012,89 @@ except Exception:
         # Save FAISS index
         faiss.write_index(self.faiss_index, str(index_path))
         
+        # Written last: marks the files above as matching this library
+        hash_path.write_text(self._library_hash())
+        
         print(f"💾 Cached enhanced embeddings to {self.cache_dir}")
     
     def _load_embeddings(self):
         """Load embeddings from disk"""
-        embeddings_path = self.cache_dir / "enhanced_embeddings.pkl"
+        embeddings_path = self.cache_dir / "enhanced_embeddings.npy"
         index_path = self.cache_dir / "enhanced_faiss_index.bin"
         keys_path = self.cache_dir / "enhanced_keys.pkl"
         
         try:
-            # Load embeddings and keys
-            with open(embeddings_path, 'rb') as f:
-                self.embeddings = pickle.load(f)
+            # Load embeddings and keys; copied out of the mapping so _save_embeddings
+            # can replace the file while the embedder cache holds seeded rows
+            self.embeddings = np.array(np.load(embeddings_path, mmap_mode='r'))
             
             with open(keys_path, 'rb') as f:
                 self.reference_keys = pickle.load(f)
             
             # Load FAISS index
             self.faiss_index = faiss.read_index(str(index_path))
+            self._set_ef_search(self.faiss_index)
             
+            # Reference texts are already embedded on disk
+            if self.reference_keys == list(self.library):
+                self.embedder.seed(self.reference_texts(), self.embeddings)
+            
+            self.embeddings_from_cache = True
             print(f"📚 Loaded cached enhanced embeddings for {len(self.reference_keys)} references")
             
         except Exception as e:
             print(f"❌ Failed to load cached embeddings: {e}")
             self._create_embeddings()
     
+    def reference_texts(self) -> List[str]:
+        """Embedding texts for every reference, in library order"""
+        # Enhanced text includes complexity and category
+        return [f"{key.replace('_', ' ')} {example['description']} {example['complexity']} {example['category']}"
+                for key, example in self.library.items()]
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Run the embedding model in batches, L2-normalized on the model's device"""
+        embeddings = self.embedding_model.encode(texts, batch_size=64, convert_to_numpy=True,
+                                                 normalize_embeddings=True)
+        return np.asarray(embeddings, dtype='float32')
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Encode texts into L2-normalized float32 embeddings"""
+        return self.embedder.encode(texts)
+    
     def semantic_search(self, query: str, top_k: int = 2, threshold: float = 0.3) -> List[Tuple[str, float]]:
         """Enhanced semantic search with complexity consideration"""
+        return self.semantic_search_multi([query], top_k=top_k, threshold=threshold)
+    
+    def semantic_search_multi(self, queries: List[str], top_k: int = 2, threshold: float = 0.3) -> List[Tuple[str, float]]:
+        """Semantic search over several sub-queries embedded in one batch
+        
+        Each reference keeps its best similarity across the sub-queries.
+        """
         if self.faiss_index is None:
             print("❌ Embeddings not initialized")
             return [("simple_box", 1.0)]  # Fallback
         
         try:
-            # Encode query
-            query_embedding = self.embedding_model.encode([query])
-            faiss.normalize_L2(query_embedding)  # Normalize for cosine similarity
+            # Encode all queries in one batch (normalized for cosine similarity)
+            query_embeddings = self.embed(queries)
             
             # Search with larger pool first
             search_k = min(len(self.reference_keys), top_k * 3)
-            similarities, indices = self.faiss_index.search(query_embedding.astype('float32'), search_k)
+            similarities, indices = self.faiss_index.search(query_embeddings, search_k)
+            
+            # Max-pool similarity per reference across sub-queries
+            best_matches = {}
+            for row_similarities, row_indices in zip(similarities, indices):
+                for similarity, idx in zip(row_similarities, row_indices):
+                    if idx >= 0 and similarity > best_matches.get(idx, -1.0):
+                        best_matches[idx] = similarity
             
             # Enhanced filtering with complexity consideration
             results = []
             complexity_scores = {"simple": 1.0, "medium": 0.9, "complex": 0.8, "advanced": 0.7}
             
-            for i, (similarity, idx) in enumerate(zip(similarities[0], indices[0])):
+            for idx, similarity in best_matches.items():
                 if similarity >= threshold:
                     key = self.reference_keys[idx]
                     example = self.library[key]
@@ -1013,9 +1111,10 @@ except Exception:
             
             # Ensure at least one result
             if not results:
-                results = [(self.reference_keys[indices[0][0]], float(similarities[0][0]))]
+                idx, similarity = max(best_matches.items(), key=lambda x: x[1])
+                results = [(self.reference_keys[idx], float(similarity))]
             
-            print(f"🔍 Enhanced search for '{query}': {[(r[0], f'{r[1]:.3f}') for r in results]}")
+            print(f"🔍 Enhanced search for {queries}: {[(r[0], f'{r[1]:.3f}') for r in results]}")
             return results
             
         except Exception as e:
@@ -1026,6 +1125,11 @@ except Exception:
         """Get reference example by key"""
         return self.library.get(key, self.library["simple_box"])
     
+    def get_references_bulk(self, keys: List[str]) -> List[Dict]:
+        """Get several reference examples by key in one call"""
+        library = self.library
+        return [library[key] if key in library else self.get_reference(key) for key in keys]
+    
     def get_all_references(self) -> Dict:
         """Get all reference examples"""
         return self.library
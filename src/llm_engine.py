@@ -1,8 +1,12 @@
 # src/llm_engine.py
 """LLM Engine with Enhanced RAG Support"""
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import json
 import time
 import os
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,6 +20,28 @@ class LLMEngine:
         self.model = model or os.getenv('DEFAULT_MODEL', 'llama3.1:8b')
         self.base_url = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
         self.performance_mode = performance_mode or os.getenv('PERFORMANCE_MODE', 'balanced')
+        
+        # Prefix caching: Ollama reuses the KV cache of a loaded model for a
+        # matching prompt prefix, so keep the model resident between requests
+        self.prefix_cache = os.getenv('PREFIX_CACHE', 'true').lower() == 'true'
+        self.keep_alive = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+        
+        # Small draft model that answers short chat turns first (fast mode only)
+        self.draft_model = os.getenv('DRAFT_MODEL', 'llama3.2:1b') if self.performance_mode == "fast" else None
+        
+        # One pooled HTTP session for all Ollama traffic (keeps connections open)
+        self._http = requests.Session()
+        self._http.mount(self.base_url, HTTPAdapter(
+            pool_connections=4, pool_maxsize=8,
+            max_retries=Retry(total=3, backoff_factor=0.2)
+        ))
+        
+        # Request tagging so a superseded request can be aborted mid-decode
+        self._request_lock = threading.Lock()
+        self._request_seq = 0
+        self.current_request_id = None
+        self._open_responses = {}  # request id -> open streaming responses
+        self._aborted = set()  # aborted ids, forgotten once their streams are released
         self._set_performance_config()
         self._verify_connection()
         
@@ -38,7 +64,7 @@ class LLMEngine:
         """Verify Ollama connection and model availability"""
         try:
             # Test connection
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response = self._http.get(f"{self.base_url}/api/tags", timeout=5)
             response.raise_for_status()
             
             # Check model availability
@@ -46,20 +72,129 @@ class LLMEngine:
             if self.model not in models:
                 raise Exception(f"Model {self.model} not found. Install: ollama pull {self.model}")
             
+            if self.draft_model and self.draft_model not in models:
+                print(f"⚠️ Draft model {self.draft_model} not found - speculative drafts disabled (ollama pull {self.draft_model})")
+                self.draft_model = None
+            
             print(f"✅ {self.model} ready ({self.performance_mode} mode) - Enhanced RAG + Intelligent Reasoning")
             
         except requests.exceptions.RequestException:
             raise Exception("Ollama not running. Start with: ollama serve")
     
-    def generate(self, prompt: str, temperature: float = 0.7) -> str:
-        """Generate response from LLM with Enhanced RAG context support"""
+    def set_prefix_cache(self, enabled: bool):
+        """Enable or disable prompt prefix KV reuse between requests"""
+        self.prefix_cache = enabled
+    
+    def begin_request(self) -> int:
+        """Start a new request id; untagged LLM calls use it until the next one"""
+        with self._request_lock:
+            self._request_seq += 1
+            self.current_request_id = self._request_seq
+            return self.current_request_id
+    
+    def abort(self, request_id: int):
+        """Stop a request: close its open streams and refuse its further calls
+        
+        Closing the HTTP connection makes Ollama stop decoding. With no
+        stream open, the request's next call is refused instead.
+        """
+        if request_id is None:
+            return
+        with self._request_lock:
+            self._aborted.add(request_id)
+            responses = list(self._open_responses.get(request_id, []))
+        for response in responses:
+            response.close()
+        if responses:
+            print(f"🛑 Aborted LLM request {request_id} ({len(responses)} open streams)")
+    
+    def end_request(self, request_id: int):
+        """A request's worker is done: forget an abort that no call is left to see"""
+        with self._request_lock:
+            if request_id not in self._open_responses:
+                self._aborted.discard(request_id)
+    
+    def _resolve_request(self, request_id: int = None) -> int:
+        """The id a call is tagged with: the given one, else the current request"""
+        return self.current_request_id if request_id is None else request_id
+    
+    def _refuse_if_aborted(self, request_id: int):
+        """Raise for an aborted request, forgetting it if nothing of it is still open (lock held)"""
+        if request_id in self._aborted:
+            if request_id not in self._open_responses:
+                self._aborted.discard(request_id)
+            raise Exception("Request aborted")
+    
+    def _post_stream(self, payload: dict, request_id: int):
+        """Open a streaming generate request registered under request_id"""
+        with self._request_lock:
+            self._refuse_if_aborted(request_id)
+        
+        response = self._http.post(
+            f"{self.base_url}/api/generate",
+            json=payload,
+            stream=True,
+            timeout=self.config["timeout"]
+        )
+        with self._request_lock:
+            if request_id in self._aborted:
+                response.close()
+                self._refuse_if_aborted(request_id)
+            self._open_responses.setdefault(request_id, []).append(response)
+        return response
+    
+    def _release_stream(self, request_id: int, response):
+        """Close a stream and drop it from the open set"""
+        response.close()
+        with self._request_lock:
+            responses = self._open_responses.get(request_id)
+            if responses and response in responses:
+                responses.remove(response)
+                if not responses:
+                    del self._open_responses[request_id]
+            # An aborted request is forgotten once none of its streams are open
+            if request_id not in self._open_responses:
+                self._aborted.discard(request_id)
+    
+    def _iter_stream(self, payload: dict, request_id: int):
+        """Yield response chunks from a streaming generate request"""
+        response = self._post_stream(payload, request_id)
+        try:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise Exception(f"Ollama error: {chunk['error']}")
+                yield chunk.get("response", "")
+                if chunk.get("done"):
+                    break
+        except Exception:
+            if request_id in self._aborted:
+                raise Exception("Request aborted")
+            raise
+        finally:
+            self._release_stream(request_id, response)
+    
+    def _build_payload(self, prompt: str, temperature: float, stream: bool, max_tokens: int = None,
+                       model: str = None, num_keep: int = None) -> dict:
+        """Build Ollama generate payload
+        
+        num_keep pins that many leading prompt tokens (the system prompt)
+        when the context window has to shift.
+        """
+        num_predict = self.config["num_predict"]
+        if max_tokens:
+            num_predict = min(num_predict, max_tokens)
+        
         payload = {
-            "model": self.model,
+            "model": model or self.model,
             "prompt": prompt,
-            "stream": False,
+            "stream": stream,
             "options": {
                 "temperature": temperature,
-                "num_predict": self.config["num_predict"],
+                "num_predict": num_predict,
                 "num_ctx": self.config["num_ctx"],
                 "top_p": 0.9,
                 "repeat_penalty": 1.1,
@@ -68,20 +203,36 @@ class LLMEngine:
                 "use_mlock": True
             }
         }
+        if num_keep:
+            payload["options"]["num_keep"] = num_keep
+        if self.prefix_cache:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+    
+    def generate(self, prompt: str, temperature: float = 0.7, max_tokens: int = None, model: str = None,
+                 num_keep: int = None, on_chunk=None, request_id: int = None) -> str:
+        """Generate response from LLM with Enhanced RAG context support
+        
+        on_chunk(text) is called with each decoded chunk as it arrives.
+        request_id tags the call for abort(); by default the current request.
+        """
+        request_id = self._resolve_request(request_id)
+        # Streamed under the hood so abort() can cut decoding short
+        payload = self._build_payload(prompt, temperature, stream=True, max_tokens=max_tokens, model=model,
+                                      num_keep=num_keep)
         
         # Debug logging for Enhanced RAG
         prompt_length = len(prompt)
-        print(f"🔧 Enhanced RAG-LLM Config: temp={temperature}, predict={self.config['num_predict']}, ctx={self.config['num_ctx']}")
+        print(f"🔧 Enhanced RAG-LLM Config: temp={temperature}, predict={payload['options']['num_predict']}, ctx={self.config['num_ctx']}")
         print(f"📝 Prompt length: {prompt_length} chars (Enhanced RAG)")
         
         try:
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=self.config["timeout"]
-            )
-            response.raise_for_status()
-            result = response.json().get("response", "").strip()
+            parts = []
+            for chunk in self._iter_stream(payload, request_id):
+                parts.append(chunk)
+                if on_chunk:
+                    on_chunk(chunk)
+            result = "".join(parts).strip()
             
             print(f"📝 Enhanced RAG-LLM Response length: {len(result)} chars")
             return result
@@ -89,6 +240,56 @@ class LLMEngine:
             print(f"❌ Enhanced RAG-LLM Error: {e}")
             return f"Error: {str(e)}"
     
+    def generate_speculative(self, prompt: str, temperature: float = 0.7, accept=None,
+                             draft_tokens: int = 256, num_keep: int = None, on_chunk=None,
+                             request_id: int = None) -> str:
+        """Answer with the draft model when accept(draft) passes, else the main model
+        
+        Ollama exposes no token scoring, so the caller's accept() check
+        stands in for verification by the main model. Only the main-model
+        answer is streamed to on_chunk.
+        """
+        request_id = self._resolve_request(request_id)
+        if self.draft_model:
+            draft = self.generate(prompt, temperature, max_tokens=draft_tokens, model=self.draft_model,
+                                  num_keep=num_keep, request_id=request_id)
+            if not draft.startswith("Error:") and (accept is None or accept(draft)):
+                print(f"⚡ Draft accepted from {self.draft_model}")
+                return draft
+            print(f"🔁 Draft rejected - regenerating with {self.model}")
+        return self.generate(prompt, temperature, num_keep=num_keep, on_chunk=on_chunk, request_id=request_id)
+    
+    def generate_stream(self, prompt: str, temperature: float = 0.7, max_tokens: int = None,
+                        request_id: int = None):
+        """Stream response chunks from LLM as they are decoded
+        
+        Closing the generator early closes the HTTP connection, which stops
+        Ollama from decoding the rest of the response. The request id is
+        resolved when this is called, not when iteration starts.
+        """
+        request_id = self._resolve_request(request_id)
+        payload = self._build_payload(prompt, temperature, stream=True, max_tokens=max_tokens)
+        
+        print(f"🔧 Enhanced RAG-LLM Config (stream): temp={temperature}, predict={payload['options']['num_predict']}, ctx={self.config['num_ctx']}")
+        print(f"📝 Prompt length: {len(prompt)} chars (Enhanced RAG)")
+        
+        return self._iter_stream(payload, request_id)
+    
+    def warm_up(self):
+        """Ask Ollama to load the model into memory ahead of the first prompt"""
+        try:
+            self._http.post(
+                f"{self.base_url}/api/generate",
+                json={"model": self.model, "keep_alive": self.keep_alive},
+                timeout=self.config["timeout"]
+            )
+        except Exception as e:
+            print(f"⚠️ LLM warm-up failed: {e}")
+    
+    def close(self):
+        """Close pooled HTTP connections"""
+        self._http.close()
+    
     def validate_enhanced_rag_context_size(self, prompt: str) -> bool:
         """Validate that Enhanced RAG prompt fits within context window"""
         # Rough estimate: 4 chars per token